@@ -0,0 +1,389 @@
+"""Offline micro-benchmarks for the bot's hot paths.
+
+    python -m benchmarks.bench                  # run and compare with the baseline
+    python -m benchmarks.bench --save-baseline  # store results as the new baseline
+    python -m benchmarks.bench --quick          # skip the large DataFrame sizes
+    python -m benchmarks.bench -k sales         # only benchmarks whose name contains "sales"
+
+S3 is replaced by an in-memory client serving synthetic pipe-delimited CSVs,
+so nothing leaves the machine. Results are median seconds per call.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+# src.constants reads these at import time, the values are never used here
+for name in ("DISCORD_BOT_TOKEN", "DISCORD_CLIENT_ID", "OPENAI_API_KEY", "TENOR_KEY"):
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("ALLOWED_SERVER_IDS", "1")
+os.environ.setdefault("SERVER_TO_MODERATION_CHANNEL", "1:1")
+os.environ.setdefault("S3_CACHE_DIR", os.path.join(tempfile.gettempdir(), "barbarian-bot-bench-s3"))
+# the warm admin table and role helper cases never revalidate during a run
+os.environ.setdefault("ADMIN_TABLE_REVALIDATE_SECONDS", "3600")
+os.environ.setdefault("ROLE_HELPER_REVALIDATE_SECONDS", "3600")
+
+import discord
+import pandas as pd
+
+from src import base, getRoles, utils
+import src.discordAdminListing as discordAdminListing
+import src.discordNftListing as discordNftListing
+import src.discordNftSales as discordNftSales
+import src.nftCommon as nftCommon
+import src.s3helper as s3helper
+from tests.fakes import fake_s3
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baseline.json")
+TOKEN_ID = "0.0.2235264"
+SEED = 1234
+
+
+def to_csv_bytes(df: pd.DataFrame, header: bool = True) -> bytes:
+    return df.to_csv(sep="|", index=False, header=header).encode("utf-8")
+
+
+def data_key(filename: str) -> str:
+    return f"public/data-analytics/{TOKEN_ID}/{filename}"
+
+
+def synthetic_accounts(rng: random.Random, count: int) -> List[str]:
+    return [f"0.0.{rng.randint(100000, 4000000)}" for _ in range(count)]
+
+
+def synthetic_times(rng: random.Random, rows: int) -> List[str]:
+    start = datetime(2023, 1, 1)
+    return sorted(
+        (start + timedelta(seconds=rng.randint(0, 600 * 24 * 3600))).strftime("%Y-%m-%d %H:%M:%S")
+        for _ in range(rows)
+    )
+
+
+def synthetic_transactions(rows: int, serials: int = 5000) -> pd.DataFrame:
+    rng = random.Random(SEED)
+    accounts = synthetic_accounts(rng, 2000)
+    return pd.DataFrame(
+        {
+            "txn_time": synthetic_times(rng, rows),
+            "account_id_seller": [rng.choice(accounts) for _ in range(rows)],
+            "account_id_buyer": [rng.choice(accounts) for _ in range(rows)],
+            "serial_number": [rng.randint(1, serials) for _ in range(rows)],
+            "market_name": [rng.choice(["SentX", "Zuse"]) for _ in range(rows)],
+            "amount": [round(rng.uniform(50, 5000), 2) for _ in range(rows)],
+        }
+    )
+
+
+def synthetic_listings(rows: int, serials: int = 5000) -> pd.DataFrame:
+    rng = random.Random(SEED + 1)
+    accounts = synthetic_accounts(rng, 2000)
+    return pd.DataFrame(
+        {
+            "txn_time": synthetic_times(rng, rows),
+            "txn_type": [rng.choice(["List", "Updated Price"]) for _ in range(rows)],
+            "account_id_seller": [rng.choice(accounts) for _ in range(rows)],
+            "serial_number": [rng.randint(1, serials) for _ in range(rows)],
+            "market_name": [rng.choice(["SentX", "Zuse"]) for _ in range(rows)],
+            "amount": [round(rng.uniform(50, 5000), 2) for _ in range(rows)],
+            "old_amount": [round(rng.uniform(50, 5000), 2) for _ in range(rows)],
+        }
+    )
+
+
+def admin_objects(rows: int) -> Dict[str, bytes]:
+    rng = random.Random(SEED + 2)
+    accounts = synthetic_accounts(rng, 2000)
+    serials = 5000
+    collection = pd.DataFrame(
+        {
+            "account_id": [rng.choice(accounts) for _ in range(serials)],
+            "serial_number": range(1, serials + 1),
+            "spender": [rng.choice([None, "0.0.1064038"]) for _ in range(serials)],
+        }
+    )
+    mints = pd.DataFrame(
+        {
+            "account_id_buyer": [rng.choice(accounts) for _ in range(serials)],
+            "serial_number": range(1, serials + 1),
+            "amount": [rng.choice([100, 150]) for _ in range(serials)],
+        }
+    )
+    discord_accounts = pd.DataFrame(
+        {
+            "account_id": accounts[:500],
+            "name": [f"user{i}" for i in range(500)],
+            "user_id": [rng.randint(10**17, 10**18) for _ in range(500)],
+            "timestamp": ["2023-09-01 00:00:00"] * 500,
+        }
+    )
+    return {
+        data_key("nft_collection.csv"): to_csv_bytes(collection),
+        data_key("nft_listings.csv"): to_csv_bytes(synthetic_listings(rows)),
+        data_key("nft_transactions.csv"): to_csv_bytes(synthetic_transactions(rows)),
+        data_key("nft_mints.csv"): to_csv_bytes(mints),
+        "public/discordAccounts/accounts.csv": to_csv_bytes(discord_accounts, header=False),
+    }
+
+
+def role_helper(entries: int = 10000) -> List[dict]:
+    rng = random.Random(SEED + 3)
+    races = ["Mortal", "Gaian", "Runekin", "Soulweaver", "Zephyr", "ArchAngel"]
+    helper = []
+    for token_id in (getRoles.CFP_TOKEN_ID, getRoles.TLO_TOKEN_ID):
+        for serial in range(1, entries // 2 + 1):
+            helper.append(
+                {
+                    "tokenId": token_id,
+                    "serial_number": serial,
+                    "race": rng.choice(races),
+                    "isZombieSpirit": int(rng.random() < 0.05),
+                }
+            )
+    return helper
+
+
+def wallet(nfts: int) -> List[dict]:
+    rng = random.Random(SEED + 4)
+    tokens = [getRoles.CFP_TOKEN_ID, getRoles.TLO_TOKEN_ID, "0.0.1234567"]
+    return [
+        {"token_id": rng.choice(tokens), "serial_number": rng.randint(1, 5000)}
+        for _ in range(nfts)
+    ]
+
+
+def fake_discord_message(content: str):
+    return SimpleNamespace(
+        type=discord.MessageType.default,
+        content=content,
+        author=SimpleNamespace(name="Barbarian"),
+        reference=None,
+    )
+
+
+def conversation(messages: int) -> base.Conversation:
+    rng = random.Random(SEED + 5)
+    words = "brother champ hbarbarian founders pass lost ones gaian runekin wooo".split()
+    return base.Conversation(
+        [
+            base.Message(f"user{i % 4}", " ".join(rng.choice(words) for _ in range(25)))
+            for i in range(messages)
+        ]
+    )
+
+
+Case = Tuple[str, Callable[[], object], Callable[[], object]]
+
+
+def chat_cases() -> List[Case]:
+    cases: List[Case] = []
+    header = base.Message("System", "Instructions for B-TeamChairMan: " + "be loud. " * 60)
+    examples = [conversation(4) for _ in range(8)]
+    for size in (10, 100, 200):
+        convo = conversation(size)
+        prompt = base.Prompt(header=header, examples=examples, convo=convo)
+        cases.append((f"conversation_render_{size}", lambda: None, convo.render))
+        cases.append((f"prompt_render_{size}", lambda: None, prompt.render))
+
+    long_reply = "Oooh yeah brother! " * 400
+    cases.append(("split_into_shorter_messages_7k", lambda: None, lambda: utils.split_into_shorter_messages(long_reply)))
+
+    messages = [fake_discord_message(c) for c in ("!gm", "hey bteam whats up", "regular chat message " * 10)]
+    cases.append(
+        (
+            "discord_message_to_message_x3",
+            lambda: None,
+            lambda: [utils.discord_message_to_message(m) for m in messages],
+        )
+    )
+    return cases
+
+
+def role_cases() -> List[Case]:
+    cases: List[Case] = []
+    helper = json.dumps(role_helper()).encode("utf-8")
+    objects = {"public/discordAccounts/discordRoleHelper.json": helper}
+    for size in (10, 100, 1000):
+        nfts = wallet(size)
+        cases.append(
+            (
+                f"match_nfts_to_discord_helper_{size}",
+                lambda: None,
+                lambda nfts=nfts: _with_s3(objects, getRoles.match_nfts_to_discord_helper, nfts),
+            )
+        )
+        cases.append(
+            (
+                f"match_nfts_to_discord_helper_warm_{size}",
+                lambda nfts=nfts: _with_s3(objects, getRoles.match_nfts_to_discord_helper, nfts),
+                lambda nfts=nfts: _with_warm_s3(objects, getRoles.match_nfts_to_discord_helper, nfts),
+            )
+        )
+        with fake_s3(dict(objects)):
+            matched = getRoles.match_nfts_to_discord_helper(nfts)
+        cases.append((f"determine_roles_{size}", lambda: None, lambda m=matched: getRoles.determine_roles(m)))
+    return cases
+
+
+def pipeline_cases(sizes: List[int]) -> List[Case]:
+    cases: List[Case] = []
+    config = {"last_discord_listings_ts": "", "last_discord_sales_ts": ""}
+    for rows in sizes:
+        label = f"{rows // 1000}k" if rows < 1_000_000 else f"{rows // 1_000_000}m"
+        sales = {data_key("nft_transactions.csv"): to_csv_bytes(synthetic_transactions(rows))}
+        listings = {data_key("nft_listings.csv"): to_csv_bytes(synthetic_listings(rows))}
+        admin = admin_objects(rows)
+        cases.append(
+            (
+                f"discord_nft_sales_{label}",
+                lambda: None,
+                lambda o=sales: _with_s3(o, discordNftSales.discord_nft_sales, TOKEN_ID, dict(config)),
+            )
+        )
+        cases.append(
+            (
+                f"discord_nft_sales_unchanged_{label}",
+                lambda o=sales: _with_s3(o, discordNftSales.discord_nft_sales, TOKEN_ID, dict(config)),
+                lambda o=sales: _with_warm_s3(o, discordNftSales.discord_nft_sales, TOKEN_ID, dict(config)),
+            )
+        )
+        cases.append(
+            (
+                f"discord_nft_listings_{label}",
+                lambda: None,
+                lambda o=listings: _with_s3(o, discordNftListing.discord_nft_listings, TOKEN_ID, dict(config)),
+            )
+        )
+        frame = s3helper._apply_schema(synthetic_transactions(rows), discordNftSales.SALES_SCHEMA)
+        cases.append(
+            (
+                f"latest_per_serial_groupby_apply_{label}",
+                lambda: None,
+                lambda df=frame: legacy_latest_per_serial(df),
+            )
+        )
+        cases.append(
+            (
+                f"latest_per_serial_vectorized_{label}",
+                lambda: None,
+                lambda df=frame: nftCommon.latest_per_serial(df),
+            )
+        )
+        cases.append(
+            (
+                f"admin_listing_execute_{label}",
+                lambda: None,
+                lambda o=admin: _with_s3(o, discordAdminListing.execute, TOKEN_ID),
+            )
+        )
+        cases.append(
+            (
+                f"admin_listing_page_warm_{label}",
+                lambda o=admin: _with_s3(o, discordAdminListing.execute, TOKEN_ID),
+                lambda: discordAdminListing.page(TOKEN_ID, "total_sale_volume", True, 2),
+            )
+        )
+    return cases
+
+
+def legacy_latest_per_serial(df: pd.DataFrame) -> pd.DataFrame:
+    # the per-group sort the sales and listings pipelines used before nftCommon
+    return df.groupby("serial_number", group_keys=True).apply(
+        lambda x: x.sort_values("txn_time", ascending=False).iloc[0]
+    )
+
+
+def _with_s3(objects: Dict[str, bytes], fn: Callable, *args):
+    # measure parsing too, not only the in-memory DataFrame cache or the
+    # filtered reads stored next to the cached objects
+    s3helper._df_cache.clear()
+    discordAdminListing._tables.clear()
+    getRoles._helper_index = None
+    getRoles._helper_etag = None
+    getRoles._helper_checked_at = 0.0
+    for path in glob.glob(os.path.join(s3helper.S3_CACHE_DIR, "*.filtered.csv")):
+        os.remove(path)
+    return _with_warm_s3(objects, fn, *args)
+
+
+def _with_warm_s3(objects: Dict[str, bytes], fn: Callable, *args):
+    with fake_s3(dict(objects)):
+        return fn(*args)
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(runs), "min": min(runs), "number": number}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--quick", action="store_true", help="only 10k row DataFrame benchmarks")
+    parser.add_argument("-k", dest="keyword", default="", help="only run benchmarks containing this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    sizes = [10_000] if args.quick else [10_000, 100_000, 1_000_000]
+    cases = chat_cases() + role_cases() + pipeline_cases(sizes)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+
+    results = {}
+    print(f"{'benchmark':<40}{'median':>12}{'baseline':>12}{'change':>10}")
+    for name, setup, fn in cases:
+        if args.keyword not in name:
+            continue
+        setup()
+        result = measure(fn, args.repeat)
+        results[name] = result
+        before = baseline.get(name, {}).get("median")
+        change = f"{(result['median'] / before - 1) * 100:+.1f}%" if before else ""
+        print(
+            f"{name:<40}{_fmt(result['median']):>12}{_fmt(before) if before else '-':>12}{change:>10}"
+        )
+        sys.stdout.flush()
+
+    if args.save_baseline:
+        merged = dict(baseline)
+        merged.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "machine": platform.machine(),
+                    "saved_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+                    "results": merged,
+                },
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        print(f"baseline saved to {args.baseline}")
+
+
+def _fmt(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+if __name__ == "__main__":
+    main()
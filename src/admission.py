@@ -0,0 +1,192 @@
+import asyncio
+import random
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional
+import openai
+from src.constants import (
+    COMPLETION_WORKERS,
+    COMPLETION_INTERACTIVE_WEIGHT,
+    COMPLETION_RATE_LIMIT_RETRIES,
+    COMPLETION_RATE_LIMIT_BACKOFF_SECONDS,
+    COMPLETION_RATE_LIMIT_MAX_BACKOFF_SECONDS,
+)
+from src.utils import logger
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # threads and /chat
+    BACKGROUND = 1  # !gm, bteam, !recap, welcomes
+
+
+@dataclass
+class AdmissionJob:
+    factory: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    guild_id: Optional[int]
+    channel_id: Optional[int]
+    priority: Priority
+    enqueued_at: float = field(default_factory=time.monotonic)
+    task: Optional[asyncio.Task] = None
+
+
+class CompletionAdmission:
+    """Bounded pool of workers in front of openai. Waiting jobs are served by
+    priority (weighted, so background work is not starved), round robin over
+    guilds and then over channels within a guild. Rate limit responses pause
+    every worker and the job is retried after a backoff."""
+
+    def __init__(
+        self,
+        workers: int,
+        interactive_weight: int,
+        max_retries: int,
+        backoff_seconds: float,
+        max_backoff_seconds: float,
+    ):
+        self.workers = workers
+        self.interactive_weight = interactive_weight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        # priority -> guild -> channel -> jobs, dict order is the round robin order
+        self._queues: Dict[Priority, "OrderedDict[Optional[int], OrderedDict]"] = {
+            p: OrderedDict() for p in Priority
+        }
+        self._queued = 0
+        self._interactive_streak = 0
+        self._paused_until = 0.0
+        # created on first use so they belong to the running event loop
+        self._wakeup: Optional[asyncio.Semaphore] = None
+        self._worker_tasks = []
+
+    async def submit(
+        self,
+        factory: Callable[[], Awaitable[Any]],
+        guild_id: Optional[int],
+        channel_id: Optional[int],
+        priority: Priority,
+    ) -> Any:
+        self._start()
+        job = AdmissionJob(
+            factory=factory,
+            future=asyncio.get_running_loop().create_future(),
+            guild_id=guild_id,
+            channel_id=channel_id,
+            priority=priority,
+        )
+
+        def cancel_running(future: asyncio.Future):
+            # a cancelled caller (e.g. a superseded thread reply) cancels the running job too
+            if future.cancelled() and job.task is not None:
+                job.task.cancel()
+
+        job.future.add_done_callback(cancel_running)
+        guilds = self._queues[priority]
+        channels = guilds.setdefault(guild_id, OrderedDict())
+        channels.setdefault(channel_id, deque()).append(job)
+        self._queued += 1
+        self._wakeup.release()
+        return await job.future
+
+    def queue_depth(self) -> int:
+        return self._queued
+
+    def _start(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Semaphore(0)
+            self._worker_tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    def _next_job(self) -> Optional[AdmissionJob]:
+        interactive = self._queues[Priority.INTERACTIVE]
+        background = self._queues[Priority.BACKGROUND]
+        if interactive and (not background or self._interactive_streak < self.interactive_weight):
+            self._interactive_streak += 1
+            guilds = interactive
+        elif background:
+            self._interactive_streak = 0
+            guilds = background
+        else:
+            return None
+
+        guild_id, channels = next(iter(guilds.items()))
+        channel_id, jobs = next(iter(channels.items()))
+        job = jobs.popleft()
+        self._queued -= 1
+        # rotate so the next job comes from another channel / guild
+        del channels[channel_id]
+        if jobs:
+            channels[channel_id] = jobs
+        del guilds[guild_id]
+        if channels:
+            guilds[guild_id] = channels
+        return job
+
+    async def _worker(self):
+        while True:
+            await self._wakeup.acquire()
+            job = self._next_job()
+            if job is None or job.future.done():
+                continue
+            waited = time.monotonic() - job.enqueued_at
+            if waited > 1:
+                logger.info(
+                    f"Completion for guild {job.guild_id} channel {job.channel_id} waited {waited:.1f}s, {self._queued} queued"
+                )
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.exception(e)
+
+    async def _run(self, job: AdmissionJob):
+        attempt = 0
+        while not job.future.done():
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                if job.future.done():
+                    return
+
+            job.task = asyncio.ensure_future(job.factory())
+            try:
+                result = await job.task
+            except openai.error.RateLimitError as e:
+                if attempt >= self.max_retries:
+                    job.future.set_exception(e)
+                    return
+                backoff = self._backoff(e, attempt)
+                self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+                logger.info(f"Rate limited by openai, pausing completions for {backoff:.1f}s")
+                attempt += 1
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+
+    def _backoff(self, error: openai.error.RateLimitError, attempt: int) -> float:
+        retry_after = (error.headers or {}).get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), self.max_backoff_seconds)
+        except ValueError:
+            pass
+        backoff = min(self.backoff_seconds * 2**attempt, self.max_backoff_seconds)
+        return backoff * (0.5 + random.random())
+
+
+completion_admission = CompletionAdmission(
+    workers=COMPLETION_WORKERS,
+    interactive_weight=COMPLETION_INTERACTIVE_WEIGHT,
+    max_retries=COMPLETION_RATE_LIMIT_RETRIES,
+    backoff_seconds=COMPLETION_RATE_LIMIT_BACKOFF_SECONDS,
+    max_backoff_seconds=COMPLETION_RATE_LIMIT_MAX_BACKOFF_SECONDS,
+)
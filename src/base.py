@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, List
 
 SEPARATOR_TOKEN = "<|endoftext|>"
@@ -30,6 +30,43 @@ class Conversation:
         )
 
 
+@dataclass
+class RenderedConversation:
+    """Conversation that keeps its rendered text up to date as messages are
+    appended, so only new messages are rendered on each request."""
+
+    messages: List[Message] = field(default_factory=list)
+    rendered: str = ""
+    # start of each message inside rendered, used to drop the oldest messages
+    offsets: List[int] = field(default_factory=list)
+
+    def append(self, message: Message):
+        if self.messages:
+            self.rendered += f"\n{SEPARATOR_TOKEN}"
+        self.offsets.append(len(self.rendered))
+        self.rendered += message.render()
+        self.messages.append(message)
+        return self
+
+    def render_from(self, start: int) -> str:
+        if start >= len(self.messages):
+            return ""
+        return self.rendered[self.offsets[start] :]
+
+    def sync(self, messages: List[Message]):
+        # only extend when the cached messages are still the start of the thread,
+        # otherwise (edits, deletes, history window moved) render from scratch
+        known = len(self.messages)
+        if messages[:known] != self.messages:
+            self.messages = []
+            self.rendered = ""
+            self.offsets = []
+            known = 0
+        for message in messages[known:]:
+            self.append(message)
+        return self
+
+
 @dataclass(frozen=True)
 class Config:
     name: str
@@ -43,11 +80,15 @@ class Prompt:
     examples: List[Conversation]
     convo: Conversation
 
-    def render(self):
+    def render_prefix(self):
         return f"\n{SEPARATOR_TOKEN}".join(
             [self.header.render()]
             + [Message("System", "Example conversations:").render()]
             + [conversation.render() for conversation in self.examples]
             + [Message("System", "Current conversation:").render()]
-            + [self.convo.render()],
+        )
+
+    def render(self):
+        return f"\n{SEPARATOR_TOKEN}".join(
+            [self.render_prefix()] + [self.convo.render()],
         )
@@ -1,17 +1,34 @@
+import asyncio
+import time
+from collections import OrderedDict
 from enum import Enum
 from dataclasses import dataclass
 import openai
-from typing import Union
+from typing import Callable, Union
 from src.moderation import moderate_message
 from typing import Optional, List
 from src.constants import (
     BOT_INSTRUCTIONS,
     BOT_NAME,
     EXAMPLE_CONVOS,
+    COMPLETION_MODEL,
+    COMPLETION_MAX_TOKENS,
+    COMPLETION_REQUEST_TIMEOUT,
+    COMPLETION_TIMEOUT_SECONDS,
+    PROMPT_TOKEN_BUDGET,
+    STREAM_EDIT_INTERVAL_SECONDS,
+    STREAM_MODERATION_INTERVAL_CHARS,
 )
 import discord
-from src.base import Message, Prompt, Conversation
+from src.base import Message, Prompt, Conversation, RenderedConversation, SEPARATOR_TOKEN
 from src.utils import split_into_shorter_messages, close_thread, logger
+from src.context import (
+    count_tokens,
+    first_message_in_budget,
+    message_tokens,
+    omitted_messages_notice,
+)
+from src.admission import Priority, completion_admission
 from src.moderation import (
     send_moderation_flagged_message,
     send_moderation_blocked_message,
@@ -19,6 +36,12 @@ from src.moderation import (
 
 MY_BOT_NAME = BOT_NAME
 MY_BOT_EXAMPLE_CONVOS = EXAMPLE_CONVOS
+# instructions + example conversations, rendered once by compile_prompt_prefix
+MY_PROMPT_PREFIX: Optional[str] = None
+
+# incrementally rendered history per conversation (thread id), most recent last
+RENDERED_CONVERSATIONS: "OrderedDict[int, RenderedConversation]" = OrderedDict()
+MAX_RENDERED_CONVERSATIONS = 500
 
 
 class CompletionResult(Enum):
@@ -35,46 +58,205 @@ class CompletionData:
     status: CompletionResult
     reply_text: Optional[str]
     status_text: Optional[str]
+    # last message already posted when the reply was streamed to the channel
+    sent_message: Optional[discord.Message] = None
+
+
+def compile_prompt_prefix() -> str:
+    """Render the static part of the prompt. Call again whenever MY_BOT_NAME or
+    MY_BOT_EXAMPLE_CONVOS change."""
+    global MY_PROMPT_PREFIX
+    MY_PROMPT_PREFIX = Prompt(
+        header=Message("System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"),
+        examples=MY_BOT_EXAMPLE_CONVOS,
+        convo=Conversation([]),
+    ).render_prefix()
+    return MY_PROMPT_PREFIX
+
+
+def render_prompt(messages: List[Message], conversation_key: Optional[int] = None) -> str:
+    prefix = MY_PROMPT_PREFIX or compile_prompt_prefix()
+    reply_line = Message(MY_BOT_NAME)
+
+    # drop the oldest messages so the prompt fits next to the reply
+    budget = PROMPT_TOKEN_BUDGET - count_tokens(prefix) - message_tokens(reply_line)
+    start = first_message_in_budget(messages, budget)
+    if start > 0:
+        notice = omitted_messages_notice(start)
+        start = first_message_in_budget(messages, budget - message_tokens(notice))
+        notice = omitted_messages_notice(start)
+        logger.info(f"Prompt over budget, leaving out {start} of {len(messages)} messages")
+
+    if conversation_key is None:
+        tail = Conversation(messages[start:]).render()
+    else:
+        conversation = RENDERED_CONVERSATIONS.pop(conversation_key, None)
+        if conversation is None:
+            conversation = RenderedConversation()
+        RENDERED_CONVERSATIONS[conversation_key] = conversation.sync(messages)
+        while len(RENDERED_CONVERSATIONS) > MAX_RENDERED_CONVERSATIONS:
+            RENDERED_CONVERSATIONS.popitem(last=False)
+        tail = conversation.render_from(start)
+
+    parts = [prefix]
+    if start > 0:
+        parts.append(notice.render())
+    if tail:
+        parts.append(tail)
+    return f"\n{SEPARATOR_TOKEN}".join(parts + [reply_line.render()])
+
+
+def _completion_request(rendered: str, stream: bool = False):
+    return openai.Completion.acreate(
+        engine=COMPLETION_MODEL,
+        prompt=rendered,
+        temperature=1.0,
+        top_p=0.9,
+        max_tokens=COMPLETION_MAX_TOKENS,
+        stop=["<|endoftext|>"],
+        request_timeout=COMPLETION_REQUEST_TIMEOUT,
+        stream=stream,
+    )
+
+
+async def _moderate_reply(rendered: str, reply: str, user: str) -> Optional[CompletionData]:
+    flagged_str, blocked_str = await moderate_message(
+        message=(rendered + reply)[-500:], user=user
+    )
+    if len(blocked_str) > 0:
+        return CompletionData(
+            status=CompletionResult.MODERATION_BLOCKED,
+            reply_text=reply,
+            status_text=f"from_response:{blocked_str}",
+        )
+
+    if len(flagged_str) > 0:
+        return CompletionData(
+            status=CompletionResult.MODERATION_FLAGGED,
+            reply_text=reply,
+            status_text=f"from_response:{flagged_str}",
+        )
+    return None
+
+
+async def _stream_completion(
+    rendered: str,
+    user: str,
+    channel: Union[discord.Thread, discord.TextChannel],
+    on_first_post: Optional[Callable[[], None]] = None,
+) -> CompletionData:
+    reply = ""
+    sent: List[discord.Message] = []
+    shown: List[str] = []
+    last_edit = 0.0
+    moderated_chars = 0
+    flagged: Optional[CompletionData] = None
+
+    async def show(text: str):
+        # edit the messages that changed, roll over into a new one past the char limit
+        for i, part in enumerate(split_into_shorter_messages(text)):
+            if not sent and on_first_post is not None:
+                on_first_post()
+            if i >= len(sent):
+                sent.append(await channel.send(part))
+                shown.append(part)
+            elif shown[i] != part:
+                await sent[i].edit(content=part)
+                shown[i] = part
+
+    async def moderate(text: str) -> Optional[CompletionData]:
+        nonlocal moderated_chars, flagged
+        moderated_chars = len(text)
+        result = await _moderate_reply(rendered, text, user)
+        if result is not None and result.status is CompletionResult.MODERATION_BLOCKED:
+            for m in sent:
+                await m.delete()
+            sent.clear()
+            return result
+        flagged = flagged or result
+        return None
+
+    async for chunk in await _completion_request(rendered, stream=True):
+        reply += chunk.choices[0].text
+        text = reply.lstrip()
+        if not text:
+            continue
+        if len(text) - moderated_chars >= STREAM_MODERATION_INTERVAL_CHARS:
+            blocked = await moderate(text)
+            if blocked:
+                return blocked
+        now = time.monotonic()
+        if not sent or now - last_edit >= STREAM_EDIT_INTERVAL_SECONDS:
+            await show(text)
+            last_edit = now
+
+    reply = reply.strip()
+    if reply and len(reply) != moderated_chars:
+        blocked = await moderate(reply)
+        if blocked:
+            return blocked
+    await show(reply)
+
+    sent_message = sent[-1] if sent else None
+    if flagged is not None:
+        flagged.reply_text = reply
+        flagged.sent_message = sent_message
+        return flagged
+    return CompletionData(
+        status=CompletionResult.OK,
+        reply_text=reply,
+        status_text=None,
+        sent_message=sent_message,
+    )
 
 
 async def generate_completion_response(
-    messages: List[Message], user: str
+    messages: List[Message],
+    user: str,
+    conversation_key: Optional[int] = None,
+    stream_to: Optional[Union[discord.Thread, discord.TextChannel]] = None,
+    on_first_post: Optional[Callable[[], None]] = None,
+    channel: Optional[discord.abc.Messageable] = None,
+    priority: Priority = Priority.INTERACTIVE,
 ) -> CompletionData:
+    """When stream_to is given the reply is posted to that channel while it is
+    generated, and the returned data carries the posted message. on_first_post
+    is called right before the first streamed message is sent.
+
+    Requests go through completion_admission, channel (defaults to stream_to)
+    and priority decide where they wait when all workers are busy."""
+    channel = channel or stream_to
+    guild = getattr(channel, "guild", None)
+    guild_id = guild.id if guild else None
+    channel_id = getattr(channel, "id", None)
     try:
-        prompt = Prompt(
-            header=Message(
-                "System", f"Instructions for {MY_BOT_NAME}: {BOT_INSTRUCTIONS}"
+        rendered = render_prompt(messages, conversation_key=conversation_key)
+        if stream_to is not None:
+            return await completion_admission.submit(
+                lambda: asyncio.wait_for(
+                    _stream_completion(rendered, user, stream_to, on_first_post),
+                    timeout=COMPLETION_TIMEOUT_SECONDS,
+                ),
+                guild_id=guild_id,
+                channel_id=channel_id,
+                priority=priority,
+            )
+
+        # acreate runs on the event loop's aiohttp session, so other threads,
+        # commands and background tasks keep being served while we wait
+        response = await completion_admission.submit(
+            lambda: asyncio.wait_for(
+                _completion_request(rendered), timeout=COMPLETION_TIMEOUT_SECONDS
             ),
-            examples=MY_BOT_EXAMPLE_CONVOS,
-            convo=Conversation(messages + [Message(MY_BOT_NAME)]),
-        )
-        rendered = prompt.render()
-        response = openai.Completion.create(
-            engine="gpt-3.5-turbo-instruct",
-            prompt=rendered,
-            temperature=1.0,
-            top_p=0.9,
-            max_tokens=512,
-            stop=["<|endoftext|>"],
+            guild_id=guild_id,
+            channel_id=channel_id,
+            priority=priority,
         )
         reply = response.choices[0].text.strip()
         if reply:
-            flagged_str, blocked_str = moderate_message(
-                message=(rendered + reply)[-500:], user=user
-            )
-            if len(blocked_str) > 0:
-                return CompletionData(
-                    status=CompletionResult.MODERATION_BLOCKED,
-                    reply_text=reply,
-                    status_text=f"from_response:{blocked_str}",
-                )
-
-            if len(flagged_str) > 0:
-                return CompletionData(
-                    status=CompletionResult.MODERATION_FLAGGED,
-                    reply_text=reply,
-                    status_text=f"from_response:{flagged_str}",
-                )
+            moderated = await _moderate_reply(rendered, reply, user)
+            if moderated is not None:
+                return moderated
 
         return CompletionData(
             status=CompletionResult.OK, reply_text=reply, status_text=None
@@ -91,6 +273,13 @@ async def generate_completion_response(
                 reply_text=None,
                 status_text=str(e),
             )
+    except asyncio.TimeoutError:
+        logger.info(f"Completion timed out after {COMPLETION_TIMEOUT_SECONDS}s for {user}")
+        return CompletionData(
+            status=CompletionResult.OTHER_ERROR,
+            reply_text=None,
+            status_text=f"Timed out after {COMPLETION_TIMEOUT_SECONDS:g} seconds",
+        )
     except Exception as e:
         logger.exception(e)
         return CompletionData(
@@ -105,15 +294,16 @@ async def process_response(
     reply_text = response_data.reply_text
     status_text = response_data.status_text
     if status is CompletionResult.OK or status is CompletionResult.MODERATION_FLAGGED:
-        sent_message = None
-        if not reply_text:
+        # a streamed reply has already been posted
+        sent_message = response_data.sent_message
+        if sent_message is None and not reply_text:
             sent_message = await channel.send(
                 embed=discord.Embed(
                     description=f"**Invalid response** - empty response",
                     color=discord.Color.yellow(),
                 )
             )
-        else:
+        elif sent_message is None:
             shorter_response = split_into_shorter_messages(reply_text)
             for r in shorter_response:
                 sent_message = await channel.send(r)
@@ -66,3 +66,82 @@ INACTIVATE_THREAD_PREFIX = "💬❌"
 MAX_CHARS_PER_REPLY_MSG = (
     1500  # discord has a 2k limit, we just break message into 1.5k
 )
+
+# openai completion settings
+COMPLETION_MODEL = os.environ.get("COMPLETION_MODEL", "gpt-3.5-turbo-instruct")
+COMPLETION_MAX_TOKENS = 512
+# context window of COMPLETION_MODEL, the prompt is trimmed to fit next to the reply
+COMPLETION_CONTEXT_TOKENS = int(os.environ.get("COMPLETION_CONTEXT_TOKENS", "4096"))
+# tokens kept free to absorb differences between local and server side counting
+COMPLETION_CONTEXT_MARGIN = 64
+PROMPT_TOKEN_BUDGET = (
+    COMPLETION_CONTEXT_TOKENS - COMPLETION_MAX_TOKENS - COMPLETION_CONTEXT_MARGIN
+)
+TOKEN_ENCODING = os.environ.get("TOKEN_ENCODING", "cl100k_base")
+# completions running at once, everything else waits in a per guild/channel fair queue
+COMPLETION_WORKERS = int(os.environ.get("COMPLETION_WORKERS", "4"))
+# interactive (thread, /chat) completions served for each background one (!gm, !recap, welcomes)
+COMPLETION_INTERACTIVE_WEIGHT = 3
+# retries after openai rate limit responses, with exponential backoff and jitter
+COMPLETION_RATE_LIMIT_RETRIES = 3
+COMPLETION_RATE_LIMIT_BACKOFF_SECONDS = 2.0
+COMPLETION_RATE_LIMIT_MAX_BACKOFF_SECONDS = 60.0
+# post thread replies while they are generated instead of after the full completion
+STREAM_COMPLETIONS = os.environ.get("STREAM_COMPLETIONS", "true").lower() == "true"
+# discord allows roughly 5 edits per 5 seconds per channel
+STREAM_EDIT_INTERVAL_SECONDS = 1.2
+# moderate the streamed reply every time it grows by this many characters
+STREAM_MODERATION_INTERVAL_CHARS = 400
+# seconds before a single http request to openai is abandoned
+COMPLETION_REQUEST_TIMEOUT = float(os.environ.get("COMPLETION_REQUEST_TIMEOUT", "30"))
+# hard upper bound for a whole completion, including retries done by the openai library
+COMPLETION_TIMEOUT_SECONDS = float(os.environ.get("COMPLETION_TIMEOUT_SECONDS", "60"))
+
+# moderation requests arriving within this window are sent as one batched call
+MODERATION_BATCH_WINDOW_SECONDS = float(
+    os.environ.get("MODERATION_BATCH_WINDOW_SECONDS", "0.05")
+)
+MODERATION_MAX_BATCH_SIZE = 32
+# number of category score results kept in memory, keyed by content hash
+MODERATION_CACHE_SIZE = int(os.environ.get("MODERATION_CACHE_SIZE", "2048"))
+
+# in-memory thread history, see src/history.py
+CONVERSATION_STORE_TTL_SECONDS = int(
+    os.environ.get("CONVERSATION_STORE_TTL_SECONDS", str(2 * 60 * 60))
+)
+CONVERSATION_STORE_MAX_THREADS = int(os.environ.get("CONVERSATION_STORE_MAX_THREADS", "200"))
+CONVERSATION_STORE_MAX_MESSAGES = int(
+    os.environ.get("CONVERSATION_STORE_MAX_MESSAGES", "20000")
+)
+
+# pre-generated replies for !gm, see src/replypool.py
+GM_POOL_TARGET_SIZE = int(os.environ.get("GM_POOL_TARGET_SIZE", "10"))
+GM_POOL_TTL_SECONDS = int(os.environ.get("GM_POOL_TTL_SECONDS", str(6 * 60 * 60)))
+# a channel never gets one of its last N pooled replies again
+GM_POOL_RECENT_PER_CHANNEL = 20
+
+# outbound listing and sales embeds, see src/dispatcher.py
+EMBED_BATCH_SIZE = 10  # discord allows at most 10 embeds per message
+EMBED_BATCH_MAX_CHARS = 6000  # combined size limit of the embeds in one message
+EMBED_SEND_RETRIES = 3
+EMBED_RETRY_BACKOFF_SECONDS = 2.0
+
+# what wakes up the listing and sales feed, see src/nftTriggers.py:
+# "sqs" (S3 event notifications), "directory" (local files), "queue" (in-process) or "" for polling only
+NFT_TRIGGER = os.environ.get("NFT_TRIGGER", "").strip().lower()
+NFT_TRIGGER_SQS_URL = os.environ.get("NFT_TRIGGER_SQS_URL", "")
+NFT_TRIGGER_DIR = os.environ.get("NFT_TRIGGER_DIR", "")
+# a run starts once notifications have been quiet this long, but never later than the max delay
+NFT_DEBOUNCE_SECONDS = float(os.environ.get("NFT_DEBOUNCE_SECONDS", "5"))
+NFT_DEBOUNCE_MAX_SECONDS = float(os.environ.get("NFT_DEBOUNCE_MAX_SECONDS", "30"))
+# fallback full run, rare when a trigger delivers the changes
+NFT_POLL_MINUTES = int(os.environ.get("NFT_POLL_MINUTES") or (60 if NFT_TRIGGER else 10))
+
+# /refreshroles, see src/roleSync.py
+ROLE_REFRESH_CONCURRENCY = int(os.environ.get("ROLE_REFRESH_CONCURRENCY", "8"))
+ROLE_REFRESH_PROGRESS_SECONDS = 5.0
+
+# local index of who holds the role tokens, see src/holdings.py
+HOLDINGS_ADVANCE_MINUTES = int(os.environ.get("HOLDINGS_ADVANCE_MINUTES", "5"))
+# full snapshot from the mirror node, catches transfers that are not marketplace sales
+HOLDINGS_RESEED_SECONDS = int(os.environ.get("HOLDINGS_RESEED_SECONDS", str(60 * 60)))
@@ -0,0 +1,51 @@
+from functools import lru_cache
+from typing import List, Optional
+import tiktoken
+from src.base import Message, SEPARATOR_TOKEN
+from src.constants import TOKEN_ENCODING
+from src.utils import logger
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding() -> Optional["tiktoken.Encoding"]:
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            # the encoding file is downloaded on first use, fall back to an estimate
+            logger.info(f"Token encoding {TOKEN_ENCODING} unavailable, estimating: {e}")
+            _encoding_failed = True
+    return _encoding
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        # conservative estimate, english text averages ~4 bytes per token
+        return len(text.encode("utf-8")) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=8192)
+def message_tokens(message: Message) -> int:
+    """Tokens a message adds to a rendered prompt, including its separator."""
+    return count_tokens(message.render()) + count_tokens(f"\n{SEPARATOR_TOKEN}")
+
+
+def first_message_in_budget(messages: List[Message], budget: int) -> int:
+    """Index of the oldest message to keep so that messages[start:] fit in budget.
+    The newest message is always kept."""
+    used = 0
+    for i in range(len(messages) - 1, -1, -1):
+        used += message_tokens(messages[i])
+        if used > budget:
+            return min(i + 1, len(messages) - 1)
+    return 0
+
+
+def omitted_messages_notice(count: int) -> Message:
+    return Message("System", f"{count} earlier messages were left out.")
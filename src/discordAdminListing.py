@@ -1,70 +1,198 @@
 import json
-import boto3
+import os
+import threading
+import time
 import pandas as pd
 import base64
 import src.s3helper as s3helper
 import io
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 
-def read_discord_users_from_s3():
-    """Read the discord users from an S3 bucket into a DataFrame."""
-    bucket = 'lost-ones-upload32737-staging'
-    key = 'public/discordAccounts/accounts.csv'
-    s3 = boto3.client('s3')
-    obj = s3.get_object(Bucket=bucket, Key=key)
+# Seconds a materialized table is served without checking the source ETags
+ADMIN_TABLE_REVALIDATE_SECONDS = float(os.environ.get('ADMIN_TABLE_REVALIDATE_SECONDS', '60'))
 
-    return pd.read_csv(obj['Body'], delimiter='|', names=['account_id', 'name', 'user_id', 'timestamp'])
+VOLUME_COLUMNS = ['total_sale_volume', 'total_buy_volume', 'total_mint_volume']
+TABLE_COLUMNS = ['account_id', 'name', 'NFTs Listed', 'lowest_list_price'] + VOLUME_COLUMNS
 
 
-def execute(token_id):
-    nfts_df = s3helper.read_df_s3(token_id, 'nft_collection.csv')
+def read_discord_users_cached():
+    """Read the discord users into a DataFrame through the local ETag cache,
+    with the ETag."""
+    path, etag = s3helper.read_object_cached(s3helper.ACCOUNTS_KEY)
+    if path is None:
+        raise FileNotFoundError(s3helper.ACCOUNTS_KEY)
+    return pd.read_csv(path, delimiter='|', names=['account_id', 'name', 'user_id', 'timestamp']), etag
+
+
+def holdings_part(nfts_df):
+    # NFT rows per account, only NFTs with a spender (listed)
     nfts_df = nfts_df[nfts_df['spender'].notna()]
+    return nfts_df.groupby('account_id').size().rename('nfts')
 
-    nft_listings = s3helper.read_df_s3(token_id, 'nft_listings.csv')
-    nft_transactions = s3helper.read_df_s3(token_id, 'nft_transactions.csv')
-    nft_mints = s3helper.read_df_s3(token_id, 'nft_mints.csv')
 
-    discord_df = read_discord_users_from_s3()
+def names_part(discord_df):
+    # one row per (account, discord name), with how often that pair is registered
+    names = discord_df[['account_id', 'name']].dropna(subset=['account_id']).copy()
+    names['name'] = names['name'].fillna('Unknown')
+    return names.groupby(['account_id', 'name']).size().rename('registrations').reset_index()
 
+
+def lowest_list_price_part(nft_listings):
     # Remove Bulk Listing entries
     nft_listings = nft_listings[nft_listings['amount'] != 'Bulk Listing']
 
     # Drop duplicates based on serial_number keeping the latest entry
     nft_listings = nft_listings.sort_values('txn_time').drop_duplicates('serial_number', keep='last')
 
+    return nft_listings.groupby('account_id_seller')['amount'].min().rename('lowest_list_price')
+
+
+def transaction_volume_part(nft_transactions):
     # Compute the total sale volume and buy volume for each seller and buyer
-    total_sale_volume = nft_transactions.groupby('account_id_seller')['amount'].sum().reset_index().rename(
-        columns={'amount': 'total_sale_volume'})
-    total_buy_volume = nft_transactions.groupby('account_id_buyer')['amount'].sum().reset_index().rename(
-        columns={'amount': 'total_buy_volume'})
-
-    # Compute the total mint volume
-    total_mint_volume = nft_mints.groupby('account_id_buyer')['amount'].sum().reset_index().rename(
-        columns={'amount': 'total_mint_volume'})
-
-    # Compute the lowest list price for each seller
-    lowest_list_price = nft_listings.groupby('account_id_seller')['amount'].min().reset_index().rename(
-        columns={'amount': 'lowest_list_price'})
-
-    merged_df = nfts_df.merge(discord_df[['account_id', 'name']], on='account_id', how='outer')
-    merged_df = merged_df.merge(total_sale_volume, left_on='account_id', right_on='account_id_seller',
-                                how='left').drop('account_id_seller', axis=1)
-    merged_df = merged_df.merge(total_buy_volume, left_on='account_id', right_on='account_id_buyer',
-                                how='left').drop('account_id_buyer', axis=1)
-    merged_df = merged_df.merge(total_mint_volume, left_on='account_id', right_on='account_id_buyer', how='left')
-    merged_df = merged_df.merge(lowest_list_price, left_on='account_id', right_on='account_id_seller', how='left')
-
-    merged_df['name'].fillna('Unknown', inplace=True)
-    merged_df.loc[:, ['total_sale_volume', 'total_buy_volume', 'total_mint_volume', 'lowest_list_price']] = \
-        merged_df[['total_sale_volume', 'total_buy_volume', 'total_mint_volume', 'lowest_list_price']].fillna(0)
-
-    # Group by account_id and name, count the NFTs, and sort the result
-    result = merged_df.groupby(['account_id', 'name']).agg(
-        {'account_id': 'count', 'lowest_list_price': 'min', 'total_sale_volume': 'sum', 'total_buy_volume': 'sum', 'total_mint_volume': 'sum'}).rename(
-        columns={'account_id': 'NFTs Listed'})
-    result = result.sort_values(by='NFTs Listed', ascending=False).reset_index()  # Drop index here
-
-    return result
+    total_sale_volume = nft_transactions.groupby('account_id_seller')['amount'].sum().rename('total_sale_volume')
+    total_buy_volume = nft_transactions.groupby('account_id_buyer')['amount'].sum().rename('total_buy_volume')
+    return total_sale_volume, total_buy_volume
+
+
+def mint_volume_part(nft_mints):
+    return nft_mints.groupby('account_id_buyer')['amount'].sum().rename('total_mint_volume')
+
+
+# source file -> function turning its DataFrame into the part the table is built from
+TOKEN_SOURCES = {
+    'nft_collection.csv': holdings_part,
+    'nft_listings.csv': lowest_list_price_part,
+    'nft_transactions.csv': transaction_volume_part,
+    'nft_mints.csv': mint_volume_part,
+}
+
+
+def combine_parts(holdings, names, lowest_list_price, transaction_volume, mint_volume):
+    """Per account and discord name: NFTs Listed, lowest list price and the
+    sale, buy and mint volumes, sorted by NFTs Listed. Same numbers as the
+    table that joined every NFT row with the accounts and the aggregates and
+    grouped the result, where an account registered under several names counts
+    its NFTs once per registration and the volumes are added up once per row."""
+    total_sale_volume, total_buy_volume = transaction_volume
+
+    # accounts with discord names, plus holders without one
+    unnamed = holdings[~holdings.index.isin(names['account_id'])]
+    table = pd.concat(
+        [
+            names,
+            pd.DataFrame({'account_id': unnamed.index, 'name': 'Unknown', 'registrations': 1}),
+        ],
+        ignore_index=True,
+    )
+    nfts = table['account_id'].map(holdings)
+    table['NFTs Listed'] = (table['registrations'] * nfts.fillna(1)).astype('int64')
+
+    table['lowest_list_price'] = table['account_id'].map(lowest_list_price).fillna(0)
+    for column, volume in zip(VOLUME_COLUMNS, (total_sale_volume, total_buy_volume, mint_volume)):
+        table[column] = table['account_id'].map(volume).fillna(0) * table['NFTs Listed']
+
+    table = table.sort_values(['account_id', 'name']).reset_index(drop=True)
+    return table[TABLE_COLUMNS].sort_values(by='NFTs Listed', ascending=False).reset_index(drop=True)
+
+
+class AdminTable:
+    """Materialized admin table of one collection. Each source object keeps its
+    part together with its ETag, a refresh only recomputes the parts whose
+    object changed and then recombines them."""
+
+    def __init__(self, token_id: str):
+        self.token_id = token_id
+        self.table: Optional[pd.DataFrame] = None
+        self.checked_at = 0.0
+        self._parts: Dict[str, Tuple[str, object]] = {}
+        self._sorted: Dict[Tuple[str, bool], pd.DataFrame] = {}
+        self._lock = threading.Lock()
+
+    def _part(self, filename, etag, build):
+        cached = self._parts.get(filename)
+        if cached is not None and cached[0] == etag:
+            return cached[1], False
+        part = build()
+        self._parts[filename] = (etag, part)
+        return part, True
+
+    def refresh(self, force: bool = False) -> pd.DataFrame:
+        with self._lock:
+            if (
+                not force
+                and self.table is not None
+                and time.monotonic() - self.checked_at < ADMIN_TABLE_REVALIDATE_SECONDS
+            ):
+                return self.table
+
+            changed = False
+            parts = {}
+            for filename, build in TOKEN_SOURCES.items():
+                _, etag = s3helper.read_object_cached(s3helper.data_key(self.token_id, filename))
+                parts[filename], rebuilt = self._part(
+                    filename,
+                    etag,
+                    lambda: build(s3helper.read_df_s3(self.token_id, filename)),
+                )
+                changed = changed or rebuilt
+
+            cached = self._parts.get('accounts')
+            _, etag = s3helper.read_object_cached(s3helper.ACCOUNTS_KEY)
+            if cached is None or cached[0] != etag:
+                discord_df, etag = read_discord_users_cached()
+                self._parts['accounts'] = (etag, names_part(discord_df))
+                changed = True
+
+            if changed or self.table is None:
+                self.table = combine_parts(
+                    parts['nft_collection.csv'],
+                    self._parts['accounts'][1],
+                    parts['nft_listings.csv'],
+                    parts['nft_transactions.csv'],
+                    parts['nft_mints.csv'],
+                )
+                self._sorted = {}
+            self.checked_at = time.monotonic()
+            return self.table
+
+    def sorted_by(self, column: str, descending: bool) -> pd.DataFrame:
+        table = self.refresh()
+        if column not in TABLE_COLUMNS:
+            raise KeyError(column)
+        if column == 'NFTs Listed' and descending:
+            return table
+        key = (column, descending)
+        with self._lock:
+            if key not in self._sorted:
+                self._sorted[key] = table.sort_values(
+                    column, ascending=not descending, kind='mergesort'
+                ).reset_index(drop=True)
+            return self._sorted[key]
+
+
+_tables: Dict[str, AdminTable] = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(token_id) -> AdminTable:
+    with _tables_lock:
+        if token_id not in _tables:
+            _tables[token_id] = AdminTable(token_id)
+        return _tables[token_id]
+
+
+def execute(token_id):
+    return get_table(token_id).refresh().copy()
+
+
+def page(token_id, sort_by='NFTs Listed', descending=True, page_number=1, page_size=10):
+    """One page of the admin table as (rows, page count)."""
+    table = get_table(token_id).sorted_by(sort_by, descending)
+    pages = max(1, -(-len(table) // page_size))
+    page_number = min(max(1, page_number), pages)
+    start = (page_number - 1) * page_size
+    return table.iloc[start:start + page_size], pages
 
 def main():
     token_id_input = "0.0.2235264"
@@ -73,4 +201,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -3,15 +3,25 @@ import json
 import time
 from datetime import datetime, timedelta
 import csv
-import pandas as pd
 import src.s3helper as s3helper
+import src.nftCommon as nftCommon
+import numpy as np
 from dotenv import load_dotenv
 import os
 import base64
 import re
 from PIL import Image
 from io import BytesIO
-import math
+
+# columns read from nft_transactions.csv
+SALES_SCHEMA = {
+    'txn_time': 'datetime',
+    'account_id_seller': 'str',
+    'account_id_buyer': 'str',
+    'serial_number': 'numeric',
+    'market_name': 'category',
+    'amount': 'numeric',
+}
 
 def discord_nft_sales(token_id, config):
     last_sales_date = config['last_discord_sales_ts']
@@ -23,78 +33,32 @@ def discord_nft_sales(token_id, config):
 
     # last_sales_timestamp = "2023-08-31 00:00:00"
 
-    # read sales csv
-    df = s3helper.read_df_s3(token_id, 'nft_transactions.csv')
+    # read sales csv, keeping only sales after the last one sent
+    filtered_df = s3helper.read_df_s3_filtered(
+        token_id,
+        'nft_transactions.csv',
+        SALES_SCHEMA,
+        row_filter=lambda chunk: chunk['txn_time'] > last_sales_timestamp,
+        cache_key=str(last_sales_timestamp),
+    )
     results = []
 
-    if df.empty == False:
-        df['txn_time'] = pd.to_datetime(df['txn_time'])
-        # Assuming df is the dataframe obtained from read_df_s3
-        filtered_df = df[df['txn_time'] > last_sales_timestamp]
-
-        # Group by 'serial_number' and take the row with the latest timestamp
-        grouped_df = filtered_df.groupby('serial_number', group_keys=True).apply(
-            lambda x: x.sort_values('txn_time', ascending=False).iloc[0])
-
-
-        for index, row in grouped_df.iterrows():
-            # Set your required variables
-            txn_time = row['txn_time']
-            account_id_seller = row['account_id_seller']
-            account_id_buyer = row['account_id_buyer']
-            serial_number = row['serial_number']
-            market_name = row['market_name']
-            amount = math.ceil(row['amount'])
-
-            name = ''
-            if token_id == '0.0.2235264':
-                name = 'Community Founders Pass'
-            if token_id == '0.0.2371643':
-                name = 'The Alixon Collection'
-            if token_id == '0.0.3721853':
-                name = 'The Lost Ones'
-            if token_id == '0.0.3954030':
-                name = 'TrizTazz - Collection 1 : 1'
-            if token_id == '0.0.4350721':
-                name = 'The Tools'
-
-            image_url = f'https://lost-ones-upload32737-staging.s3.amazonaws.com/public/data-analytics/{token_id}/images/{serial_number}.webp'
-
-            market_link = ""
-            if market_name == "SentX":
-                market_link = f"https://sentx.io/nft-marketplace/{token_id}/{serial_number}"
-            else:
-                market_link = f"https://zuse.market/collection/{token_id}"
-
-            results.append({
-                "txn_time": txn_time,
-                "account_id_seller": account_id_seller,
-                "account_id_buyer": account_id_buyer,
-                "serial_number": serial_number,
-                "market_name": market_name,
-                "amount": amount,
-                "market_link": market_link,
-                "image_url": image_url,
-                "name": name,
-            })
+    if filtered_df.empty == False:
+        # Take the row with the latest timestamp for each serial_number
+        latest_df = nftCommon.latest_per_serial(filtered_df)
+        latest_df['amount'] = np.ceil(latest_df['amount']).astype(int)
+        latest_df = nftCommon.add_display_columns(latest_df, token_id)
+
+        results = latest_df[[
+            "txn_time",
+            "account_id_seller",
+            "account_id_buyer",
+            "serial_number",
+            "market_name",
+            "amount",
+            "market_link",
+            "image_url",
+            "name",
+        ]].to_dict('records')
 
     return results
-
-def execute(token_id):
-    # Pull config file
-    config = s3helper.read_json_s3(token_id, 'nft_config.json')
-    # Pull nft_data
-    sales = discord_nft_sales(token_id, config)
-
-    if not sales:
-        return
-
-    # Sort the sales by txn_time in descending order
-    sales_sorted = sorted(sales, key=lambda x: x['txn_time'], reverse=True)
-    # Get the most recent txn_time
-    most_recent_timestamp = sales_sorted[0]['txn_time'] if sales_sorted else None
-
-    config['last_discord_sales_ts'] = most_recent_timestamp.strftime('%Y-%m-%d %H:%M:%S')
-    s3helper.upload_json_s3(token_id, 'nft_config.json', config)
-
-    return sales_sorted
@@ -0,0 +1,125 @@
+import asyncio
+import random
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+import discord
+from src.constants import (
+    EMBED_BATCH_SIZE,
+    EMBED_BATCH_MAX_CHARS,
+    EMBED_SEND_RETRIES,
+    EMBED_RETRY_BACKOFF_SECONDS,
+)
+from src.utils import logger
+
+
+class EmbedDispatcher:
+    """Ordered outbound queue per channel. Queued embeds are packed into
+    messages of up to batch_size embeds and sent back to back; pacing is left
+    to discord.py, which waits on the real rate limit buckets (and retries
+    429s) before every request. Other failures are retried with a jittered
+    backoff. submit() returns a future that resolves to whether the embed was
+    posted.
+
+    Embeds submitted with the same cancel event form a group: once a message
+    carrying one of them fails, the event is set, and the group's embeds still
+    queued (on any channel) are dropped instead of posted."""
+
+    def __init__(
+        self,
+        batch_size: int,
+        batch_max_chars: int,
+        max_retries: int,
+        backoff_seconds: float,
+    ):
+        self.batch_size = batch_size
+        self.batch_max_chars = batch_max_chars
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._queues: Dict[int, Deque[Tuple[discord.Embed, asyncio.Future, Optional[asyncio.Event]]]] = {}
+        self._channels: Dict[int, discord.abc.Messageable] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def submit(
+        self,
+        channel: discord.abc.Messageable,
+        embed: discord.Embed,
+        cancel: Optional[asyncio.Event] = None,
+    ) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(channel.id, deque()).append((embed, future, cancel))
+        self._channels[channel.id] = channel
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = asyncio.create_task(self._drain(channel.id))
+        return future
+
+    def queue_depth(self, channel_id: Optional[int] = None) -> int:
+        if channel_id is not None:
+            return len(self._queues.get(channel_id, ()))
+        return sum(len(q) for q in self._queues.values())
+
+    def _next_batch(self, queue: Deque[Tuple[discord.Embed, asyncio.Future, Optional[asyncio.Event]]]):
+        batch: List[Tuple[discord.Embed, asyncio.Future, Optional[asyncio.Event]]] = []
+        chars = 0
+        while queue and len(batch) < self.batch_size:
+            cancel = queue[0][2]
+            if cancel is not None and cancel.is_set():
+                _, future, _ = queue.popleft()
+                if not future.done():
+                    future.set_result(False)
+                continue
+            size = len(queue[0][0])
+            if batch and chars + size > self.batch_max_chars:
+                break
+            batch.append(queue.popleft())
+            chars += size
+        return batch
+
+    async def _drain(self, channel_id: int):
+        queue = self._queues[channel_id]
+        channel = self._channels[channel_id]
+        while queue:
+            batch = self._next_batch(queue)
+            if not batch:
+                break
+            sent = await self._send(channel, [embed for embed, _, _ in batch])
+            for _, future, cancel in batch:
+                if not future.done():
+                    future.set_result(sent)
+                if not sent and cancel is not None:
+                    cancel.set()
+            logger.info(
+                f"Posted {len(batch)} embeds to {channel_id}, {len(queue)} still queued"
+                if sent
+                else f"Dropped {len(batch)} embeds for {channel_id}, {len(queue)} still queued"
+            )
+        del self._queues[channel_id]
+        del self._channels[channel_id]
+        if self._workers.get(channel_id) is asyncio.current_task():
+            del self._workers[channel_id]
+
+    async def _send(self, channel: discord.abc.Messageable, embeds: List[discord.Embed]) -> bool:
+        for attempt in range(self.max_retries):
+            try:
+                await channel.send(embeds=embeds)
+                return True
+            except (discord.Forbidden, discord.NotFound) as e:
+                logger.error(f"Cannot post embeds to {channel.id}: {e}")
+                return False
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    logger.error(f"Failed to post embeds to {channel.id} after {self.max_retries} attempts: {e}")
+                    return False
+                delay = self.backoff_seconds * 2**attempt
+                delay += random.uniform(0, delay)
+                logger.info(f"Error posting embeds to {channel.id}: {e}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return False
+
+
+embed_dispatcher = EmbedDispatcher(
+    batch_size=EMBED_BATCH_SIZE,
+    batch_max_chars=EMBED_BATCH_MAX_CHARS,
+    max_retries=EMBED_SEND_RETRIES,
+    backoff_seconds=EMBED_RETRY_BACKOFF_SECONDS,
+)
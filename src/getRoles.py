@@ -1,57 +1,110 @@
-import requests
 import json
 import os
-import boto3
+import threading
+import time
+import src.s3helper as s3helper
+from src.mirrorNode import mirror_node
+from src.holdings import HoldingsIndex
 
 CFP_TOKEN_ID = '0.0.2235264'
 TLO_TOKEN_ID = '0.0.3721853'
 
-def fetch_from_mirror_node(accountId, nextUrl=None):
-    url = 'https://mainnet-public.mirrornode.hedera.com'
-    path = nextUrl or f'/api/v1/accounts/{accountId}/nfts?limit=100'
-    response = requests.get(f'{url}{path}')
-    accountNfts = response.json()
+# who holds the role tokens, kept current by main.advance_holdings
+holdings_index = HoldingsIndex([CFP_TOKEN_ID, TLO_TOKEN_ID])
+
+# Roles determine_roles hands out, the only ones role updates add or remove
+MANAGED_ROLES = [
+    'Zombie/Spirit',
+    'Hbarbarian GOD',
+    'Hbarbarian Chieftain',
+    'Hbarbarian Berserker',
+    'Hbarbarian',
+    'Gaian Treelord',
+    'Runekin High Council',
+    'Soulweaver Seer',
+    'Zephyr Ace',
+    'ArchAngel Guardian'
+]
+
+# Seconds the role helper index is used without checking the object's ETag
+ROLE_HELPER_REVALIDATE_SECONDS = float(os.environ.get('ROLE_HELPER_REVALIDATE_SECONDS', '60'))
+
+_helper_index = None
+_helper_etag = None
+_helper_checked_at = 0.0
+_helper_lock = threading.Lock()
+
+async def fetch_from_mirror_node(accountId):
+    # only the tokens that decide roles, filtered by the mirror node
+    return await mirror_node.account_nfts(accountId, token_ids=[CFP_TOKEN_ID, TLO_TOKEN_ID])
+
+def load_role_helper(path):
+    """(tokenId, serial_number) -> matched record, first helper entry wins."""
+    if path is None:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        discord_helper = json.load(f)
+
+    index = {}
+    for helper_item in discord_helper:
+        key = (helper_item['tokenId'], helper_item['serial_number'])
+        if key not in index:
+            index[key] = {
+                'token_id': helper_item['tokenId'],
+                'serial_number': helper_item['serial_number'],
+                'isZombieSpirit': helper_item.get('isZombieSpirit', 0),
+                'race': helper_item.get('race', 'Mortal')
+            }
+    return index
+
+
+def role_helper_index():
+    """The role helper index, rebuilt only when discordRoleHelper.json has a new
+    ETag. The ETag is checked at most every ROLE_HELPER_REVALIDATE_SECONDS."""
+    global _helper_index, _helper_etag, _helper_checked_at
+    with _helper_lock:
+        if _helper_index is not None and time.monotonic() - _helper_checked_at < ROLE_HELPER_REVALIDATE_SECONDS:
+            return _helper_index
+
+        path, etag = s3helper.read_object_cached(s3helper.ROLE_HELPER_KEY)
+        if _helper_index is None or etag != _helper_etag:
+            _helper_index = load_role_helper(path)
+            _helper_etag = etag
+        _helper_checked_at = time.monotonic()
+        return _helper_index
 
-    nfts = accountNfts.get('nfts', [])
-
-    # Check for a next URL in the API's paginated response
-    if 'links' in accountNfts and 'next' in accountNfts['links'] and accountNfts['links']['next']:
-        nfts += fetch_from_mirror_node(accountId, accountNfts['links']['next'])
-
-    return nfts
 
 def match_nfts_to_discord_helper(nfts):
+    index = role_helper_index()
     matched_records = []
-
-    s3 = boto3.client('s3')
-    bucket_name = 'lost-ones-upload32737-staging'
-    object_key = f'public/discordAccounts/discordRoleHelper.json'
-
-    response = s3.get_object(Bucket=bucket_name, Key=object_key)
-    res = response['Body'].read().decode('utf-8')
-    discord_helper = json.loads(res)
+    seen = set()
 
     for item in nfts:
         if item['token_id'] == CFP_TOKEN_ID or item['token_id'] == TLO_TOKEN_ID:
-            serial_number = item['serial_number']
-            token_id = item['token_id']
-
-            # Matching logic
-            for helper_item in discord_helper:
-                if helper_item['serial_number'] == serial_number and helper_item['tokenId'] == token_id:
-
-                    matched_record = {
-                        'token_id': helper_item['tokenId'],
-                        'serial_number': serial_number,
-                        'isZombieSpirit': helper_item.get('isZombieSpirit', 0),
-                        'race': helper_item.get('race', 'Mortal')
-                    }
-                    if not any(record['serial_number'] == matched_record['serial_number'] and record['token_id'] == matched_record['token_id'] for record in matched_records):
-                        matched_records.append(matched_record)
+            key = (item['token_id'], item['serial_number'])
+            if key in seen or key not in index:
+                continue
+            seen.add(key)
+            matched_records.append(dict(index[key], serial_number=item['serial_number']))
 
     return matched_records
 
 
+async def roles_for_account(accountId, live=False):
+    """Role names an account's current holdings earn. Read from the holdings
+    index once it is loaded, unless live is set: then (and until the index
+    loads) the account is fetched from the mirror node and the result is
+    written back into the index."""
+    if live or not holdings_index.ready:
+        nfts = await fetch_from_mirror_node(accountId)
+        if holdings_index.ready:
+            holdings_index.update_account(accountId, nfts)
+    else:
+        nfts = holdings_index.nfts(accountId)
+    matched_records = await s3helper.run_async(match_nfts_to_discord_helper, nfts)
+    return determine_roles(matched_records)
+
+
 def determine_roles(matched_records):
     roles = []
 
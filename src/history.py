@@ -0,0 +1,151 @@
+import asyncio
+import bisect
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+import discord
+from discord import Message as DiscordMessage
+from src.base import Message
+from src.constants import (
+    MAX_THREAD_MESSAGES,
+    CONVERSATION_STORE_TTL_SECONDS,
+    CONVERSATION_STORE_MAX_THREADS,
+    CONVERSATION_STORE_MAX_MESSAGES,
+)
+from src.utils import discord_message_to_message, logger
+
+
+@dataclass
+class ThreadHistory:
+    # discord message ids, ascending, parallel to messages
+    ids: List[int] = field(default_factory=list)
+    messages: List[Message] = field(default_factory=list)
+    last_used: float = field(default_factory=time.monotonic)
+
+    def put(self, message_id: int, message: Optional[Message]):
+        index = bisect.bisect_left(self.ids, message_id)
+        exists = index < len(self.ids) and self.ids[index] == message_id
+        if message is None:
+            if exists:
+                del self.ids[index]
+                del self.messages[index]
+        elif exists:
+            self.messages[index] = message
+        else:
+            self.ids.insert(index, message_id)
+            self.messages.insert(index, message)
+
+    def remove(self, message_id: int):
+        self.put(message_id, None)
+
+
+class ConversationStore:
+    """Thread histories kept in memory and updated from gateway events, so a
+    reply does not need to page through thread.history every time."""
+
+    def __init__(self, ttl_seconds: int, max_threads: int, max_messages: int, history_limit: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.max_messages = max_messages
+        self.history_limit = history_limit
+        self._threads: "OrderedDict[int, ThreadHistory]" = OrderedDict()
+        # updates received while a thread's history is being fetched
+        self._filling: Dict[int, List[Tuple[int, Optional[DiscordMessage]]]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._message_total = 0
+
+    async def get_messages(self, thread: discord.Thread) -> List[Message]:
+        self._evict()
+        entry = self._threads.get(thread.id)
+        if entry is None:
+            entry = await self._fill(thread)
+        self._touch(thread.id, entry)
+        return list(entry.messages)
+
+    def add(self, message: DiscordMessage):
+        self._apply(message.channel.id, message.id, message)
+
+    def update(self, message: DiscordMessage):
+        self._apply(message.channel.id, message.id, message)
+
+    def remove(self, channel_id: int, message_id: int):
+        self._apply(channel_id, message_id, None)
+
+    def discard(self, thread_id: int):
+        entry = self._threads.pop(thread_id, None)
+        if entry is not None:
+            self._message_total -= len(entry.ids)
+
+    def message_count(self) -> int:
+        return self._message_total
+
+    def _apply(self, channel_id: int, message_id: int, message: Optional[DiscordMessage]):
+        pending = self._filling.get(channel_id)
+        if pending is not None:
+            pending.append((message_id, message))
+            return
+        entry = self._threads.get(channel_id)
+        if entry is None:
+            # not tracked, it will be read from discord when it is needed
+            return
+        before = len(entry.ids)
+        self._put(entry, message_id, message)
+        self._message_total += len(entry.ids) - before
+        self._touch(channel_id, entry)
+
+    def _put(self, entry: ThreadHistory, message_id: int, message: Optional[DiscordMessage]):
+        entry.put(message_id, discord_message_to_message(message) if message else None)
+        if len(entry.ids) > self.history_limit:
+            del entry.ids[: -self.history_limit]
+            del entry.messages[: -self.history_limit]
+
+    async def _fill(self, thread: discord.Thread) -> ThreadHistory:
+        lock = self._locks.setdefault(thread.id, asyncio.Lock())
+        async with lock:
+            entry = self._threads.get(thread.id)
+            if entry is not None:
+                return entry
+
+            self._filling[thread.id] = []
+            try:
+                history = [m async for m in thread.history(limit=self.history_limit)]
+            finally:
+                pending = self._filling.pop(thread.id)
+
+            entry = ThreadHistory()
+            for m in reversed(history):
+                self._put(entry, m.id, m)
+            for message_id, message in pending:
+                self._put(entry, message_id, message)
+            self._threads[thread.id] = entry
+            self._message_total += len(entry.ids)
+            logger.info(f"Loaded {len(entry.ids)} messages for thread {thread.id}")
+        self._locks.pop(thread.id, None)
+        self._evict()
+        return entry
+
+    def _touch(self, thread_id: int, entry: ThreadHistory):
+        entry.last_used = time.monotonic()
+        if thread_id in self._threads:
+            self._threads.move_to_end(thread_id)
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._threads:
+            thread_id, entry = next(iter(self._threads.items()))
+            if (
+                entry.last_used >= cutoff
+                and len(self._threads) <= self.max_threads
+                and self._message_total <= self.max_messages
+            ):
+                break
+            self.discard(thread_id)
+
+
+conversation_store = ConversationStore(
+    ttl_seconds=CONVERSATION_STORE_TTL_SECONDS,
+    max_threads=CONVERSATION_STORE_MAX_THREADS,
+    max_messages=CONVERSATION_STORE_MAX_MESSAGES,
+    history_limit=MAX_THREAD_MESSAGES,
+)
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional, Set, Tuple
+import src.s3helper as s3helper
+from src.constants import HOLDINGS_RESEED_SECONDS
+from src.mirrorNode import mirror_node
+from src.utils import logger
+
+# columns of nft_transactions.csv needed to find the serials that moved
+DELTA_SCHEMA = {
+    'txn_time': 'datetime',
+    'serial_number': 'numeric',
+}
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def read_sales_since(token_id: str, watermark: Optional[str]) -> Tuple[Set[int], Optional[str]]:
+    """Serials sold after the watermark and the newest txn_time seen."""
+    df = s3helper.read_df_s3_filtered(
+        token_id,
+        'nft_transactions.csv',
+        DELTA_SCHEMA,
+        row_filter=(lambda chunk: chunk['txn_time'] > watermark) if watermark else None,
+        cache_key=watermark or '',
+    )
+    if df.empty:
+        return set(), watermark
+    serials = set(int(s) for s in df['serial_number'].dropna())
+    return serials, df['txn_time'].max().strftime(WATERMARK_FORMAT)
+
+
+class HoldingsIndex:
+    """Who holds which serials of the role tokens. Seeded from a full mirror
+    node snapshot, then moved forward from the marketplace sales feed
+    (nft_transactions.csv) since a per-token txn_time watermark: every serial
+    sold since then has its owner looked up on the mirror node. The mirror
+    node has no transfer feed scoped to a token, so transfers outside the
+    marketplaces are picked up by a full reseed every reseed_seconds. The
+    state is stored in S3 so a restart only has to catch up."""
+
+    def __init__(self, token_ids: List[str], key: str = s3helper.HOLDINGS_INDEX_KEY, reseed_seconds: int = HOLDINGS_RESEED_SECONDS):
+        self.token_ids = token_ids
+        self.key = key
+        self.reseed_seconds = reseed_seconds
+        self.owners: Dict[str, Dict[int, str]] = {t: {} for t in token_ids}
+        self.by_account: Dict[str, Set[Tuple[str, int]]] = {}
+        self.watermarks: Dict[str, Optional[str]] = {t: None for t in token_ids}
+        self.seeded_at = 0.0  # epoch seconds
+        self.ready = False
+        # changed outside advance() (update_account), stored on the next advance
+        self._unsaved = False
+        self._lock: Optional[asyncio.Lock] = None
+
+    def nfts(self, account_id: str) -> List[dict]:
+        """Holdings of an account, shaped like the mirror node's nft records."""
+        return [
+            {'token_id': token_id, 'serial_number': serial}
+            for token_id, serial in sorted(self.by_account.get(account_id, ()))
+        ]
+
+    def _move(self, token_id: str, serial: int, account_id: Optional[str], changed: Set[str]):
+        previous = self.owners[token_id].get(serial)
+        if previous == account_id:
+            return
+        if previous is not None:
+            held = self.by_account.get(previous)
+            if held is not None:
+                held.discard((token_id, serial))
+                if not held:
+                    del self.by_account[previous]
+            changed.add(previous)
+        if account_id is None:
+            self.owners[token_id].pop(serial, None)
+        else:
+            self.owners[token_id][serial] = account_id
+            self.by_account.setdefault(account_id, set()).add((token_id, serial))
+            changed.add(account_id)
+
+    def update_account(self, account_id: str, nfts: List[dict]) -> Set[str]:
+        """Replace an account's holdings with a live mirror node listing of it.
+        Serials it no longer holds are dropped until a sale or the next reseed
+        says where they went."""
+        changed: Set[str] = set()
+        current = set()
+        for nft in nfts:
+            if nft.get('token_id') in self.owners and not nft.get('deleted'):
+                current.add((nft['token_id'], int(nft['serial_number'])))
+        for token_id, serial in set(self.by_account.get(account_id, ())) - current:
+            self._move(token_id, serial, None, changed)
+        for token_id, serial in current:
+            self._move(token_id, serial, account_id, changed)
+        if changed:
+            self._unsaved = True
+        return changed
+
+    @staticmethod
+    def _owner(nft: dict) -> Optional[str]:
+        if not nft or nft.get('deleted'):
+            return None
+        return nft.get('account_id')
+
+    async def seed(self) -> Set[str]:
+        """Replace the holdings with a full snapshot, returns the accounts whose
+        holdings differ from before."""
+        changed: Set[str] = set()
+        for token_id in self.token_ids:
+            # watermark first, sales landing during the snapshot are looked at again
+            _, watermark = await s3helper.run_async(read_sales_since, token_id, self.watermarks[token_id])
+            snapshot = {}
+            for nft in await mirror_node.token_nfts(token_id):
+                owner = self._owner(nft)
+                if owner is not None:
+                    snapshot[int(nft['serial_number'])] = owner
+            for serial in set(self.owners[token_id]) | set(snapshot):
+                self._move(token_id, serial, snapshot.get(serial), changed)
+            self.watermarks[token_id] = watermark
+        self.seeded_at = time.time()
+        self.ready = True
+        logger.info(f"Holdings index seeded, {len(self.by_account)} holders, {len(changed)} changed")
+        return changed
+
+    async def _apply_deltas(self) -> Set[str]:
+        changed: Set[str] = set()
+        for token_id in self.token_ids:
+            serials, watermark = await s3helper.run_async(read_sales_since, token_id, self.watermarks[token_id])
+            if not serials:
+                continue
+            nfts = await asyncio.gather(*(mirror_node.nft(token_id, serial) for serial in serials))
+            for serial, nft in zip(serials, nfts):
+                if nft:
+                    self._move(token_id, serial, self._owner(nft), changed)
+            self.watermarks[token_id] = watermark
+        return changed
+
+    async def advance(self) -> Set[str]:
+        """Bring the index up to date, returns the accounts whose holdings
+        changed. Loads the stored state on first use and reseeds when the last
+        snapshot is older than reseed_seconds."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.ready:
+                await self.load()
+            watermarks = dict(self.watermarks)
+            if not self.ready or time.time() - self.seeded_at >= self.reseed_seconds:
+                changed = await self.seed()
+                await self.save()
+            else:
+                changed = await self._apply_deltas()
+                if changed or self._unsaved or self.watermarks != watermarks:
+                    await self.save()
+            return changed
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'seeded_at': self.seeded_at,
+            'watermarks': self.watermarks,
+            'owners': {t: {str(s): a for s, a in owners.items()} for t, owners in self.owners.items()},
+        })
+
+    async def save(self):
+        await s3helper.run_async(s3helper.write_text_s3, self.key, self.to_json())
+        self._unsaved = False
+
+    async def load(self) -> bool:
+        try:
+            text = await s3helper.run_async(s3helper.read_text_s3, self.key)
+        except Exception as e:
+            logger.info(f"Could not read the stored holdings index: {e}")
+            return False
+        if not text:
+            return False
+        state = json.loads(text)
+        changed: Set[str] = set()
+        for token_id in self.token_ids:
+            for serial, account_id in state.get('owners', {}).get(token_id, {}).items():
+                self._move(token_id, int(serial), account_id, changed)
+            self.watermarks[token_id] = state.get('watermarks', {}).get(token_id)
+        self.seeded_at = state.get('seeded_at', 0.0)
+        self.ready = True
+        logger.info(f"Holdings index loaded, {len(self.by_account)} holders")
+        return True
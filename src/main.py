@@ -13,6 +13,12 @@ from src.constants import (
     ACTIVATE_THREAD_PREFX,
     MAX_THREAD_MESSAGES,
     SECONDS_DELAY_RECEIVING_MSG,
+    STREAM_COMPLETIONS,
+    GM_POOL_TARGET_SIZE,
+    GM_POOL_TTL_SECONDS,
+    GM_POOL_RECENT_PER_CHANNEL,
+    NFT_POLL_MINUTES,
+    HOLDINGS_ADVANCE_MINUTES,
 )
 import asyncio
 from src.utils import (
@@ -23,21 +29,32 @@ from src.utils import (
     discord_message_to_message,
 )
 from src import completion
+from src.history import conversation_store
+from src.scheduler import DebounceScheduler
 from src import getRoles
-from src.completion import generate_completion_response, process_response
+from src import roleSync
+from src.admission import Priority
+from src.completion import (
+    CompletionData,
+    CompletionResult,
+    generate_completion_response,
+    process_response,
+)
+from src.replypool import ReplyPool
+from src.dispatcher import embed_dispatcher
+from src.nftTriggers import FeedRunner, make_trigger
 from src.moderation import (
     moderate_message,
     send_moderation_blocked_message,
     send_moderation_flagged_message,
 )
-import src.discordNftListing as discordNftListing
-import src.discordNftSales as discordNftSales
+import src.nftEvents as nftEvents
+from src.nftEvents import NftEvent
 import src.discordAdminListing as discordAdminListing
 import src.s3helper as s3helper
 import requests
 import datetime
 import pytz
-import boto3
 import csv
 import uuid
 from io import StringIO
@@ -60,6 +77,16 @@ intents.members = True
 
 client = discord.Client(intents=intents)
 tree = discord.app_commands.CommandTree(client)
+reply_scheduler = DebounceScheduler(delay=SECONDS_DELAY_RECEIVING_MSG)
+# pooled replies are generated before anyone asks, so the prompt has a generic
+# sender instead of the name of whoever sends !gm
+gm_reply_pool = ReplyPool(
+    name="gm",
+    prompt=[Message(user="Barbarian", text="Good Morning Chairman!")],
+    target_size=GM_POOL_TARGET_SIZE,
+    ttl_seconds=GM_POOL_TTL_SECONDS,
+    recent_per_channel=GM_POOL_RECENT_PER_CHANNEL,
+)
 
 @client.event
 async def on_ready():
@@ -74,8 +101,17 @@ async def on_ready():
             else:
                 messages.append(m)
         completion.MY_BOT_EXAMPLE_CONVOS.append(Conversation(messages=messages))
+    completion.compile_prompt_prefix()
     await tree.sync()
-    await discord_nfts.start()
+    if not refill_reply_pools.is_running():
+        refill_reply_pools.start()
+    # on_ready runs again after every reconnect
+    if not advance_holdings.is_running():
+        advance_holdings.start()
+    if nft_trigger is not None:
+        nft_feed.start_trigger(nft_trigger)
+    if not discord_nfts.is_running():
+        discord_nfts.start()
 
     # Add this line to start the check_inactivity function as a background task
     #client.loop.create_task(check_inactivity())
@@ -101,7 +137,7 @@ async def chat_command(int: discord.Interaction, message: str):
         logger.info(f"Chat command by {user} {message[:20]}")
         try:
             # moderate the message
-            flagged_str, blocked_str = moderate_message(message=message, user=user)
+            flagged_str, blocked_str = await moderate_message(message=message, user=user)
             await send_moderation_blocked_message(
                 guild=int.guild,
                 user=user,
@@ -155,7 +191,11 @@ async def chat_command(int: discord.Interaction, message: str):
             # fetch completion
             messages = [Message(user=user.name, text=message)]
             response_data = await generate_completion_response(
-                messages=messages, user=user
+                messages=messages,
+                user=user,
+                conversation_key=thread.id,
+                stream_to=thread if STREAM_COMPLETIONS else None,
+                channel=thread,
             )
             # send the result
             await process_response(
@@ -177,6 +217,10 @@ async def on_message(message: DiscordMessage):
         if should_block(guild=message.guild):
             return
 
+        # keep tracked thread histories current, including our own replies
+        if isinstance(channel, discord.Thread):
+            conversation_store.add(message)
+
         # ignore messages from the bot
         if message.author == client.user:
             return
@@ -196,42 +240,60 @@ async def on_message(message: DiscordMessage):
             # checks for admin content
             if message.content.lower().startswith('!cfplist'):
                 CFP = '0.0.2235264'
-                listings = discordAdminListing.execute(CFP)
+                listings = await s3helper.run_async(discordAdminListing.execute, CFP)
                 top_listings = listings.head(15)
                 await message.channel.send("```" + top_listings.to_string() + "```")
 
             # checks for admin content
             if message.content.lower().startswith('!adlist'):
                 AD = '0.0.2371643'
-                listings = discordAdminListing.execute(AD)
+                listings = await s3helper.run_async(discordAdminListing.execute, AD)
                 top_listings = listings.head(15)
                 await message.channel.send("```" + top_listings.to_string() + "```")
 
         # checks for good mornings
         if message.content.lower().startswith('!gm') or 'bteam' in message.content.lower():
-            channel_messages = [
-                discord_message_to_message(message)
-            ]
-            channel_messages = [x for x in channel_messages if x is not None]
-            channel_messages.reverse()
-
-            async with channel.typing():
-                response_data = await generate_completion_response(
-                    messages=channel_messages, user=message.author
+            # !gm is always the same prompt, so answer it from the pre-generated pool
+            pooled_reply = None
+            if message.content.lower().startswith('!gm'):
+                pooled_reply = gm_reply_pool.take(channel.id)
+                gm_reply_pool.schedule_refill()
+
+            if pooled_reply is not None:
+                await process_response(
+                    user=message.author,
+                    channel=channel,
+                    response_data=CompletionData(
+                        status=CompletionResult.OK, reply_text=pooled_reply, status_text=None
+                    ),
                 )
+            else:
+                channel_messages = [
+                    discord_message_to_message(message)
+                ]
+                channel_messages = [x for x in channel_messages if x is not None]
+                channel_messages.reverse()
+
+                async with channel.typing():
+                    response_data = await generate_completion_response(
+                        messages=channel_messages,
+                        user=message.author,
+                        channel=channel,
+                        priority=Priority.BACKGROUND,
+                    )
 
-            if is_last_message_stale(
-                    interaction_message=message,
-                    last_message=channel.last_message,
-                    bot_id=client.user.id,
-            ):
-                # there is another message and its not from us, so ignore this response
-                return
-
-            # send response
-            await process_response(
-                user=message.author, channel=channel, response_data=response_data
-            )
+                if is_last_message_stale(
+                        interaction_message=message,
+                        last_message=channel.last_message,
+                        bot_id=client.user.id,
+                ):
+                    # there is another message and its not from us, so ignore this response
+                    return
+
+                # send response
+                await process_response(
+                    user=message.author, channel=channel, response_data=response_data
+                )
 
         # checks for recaps, looks at the last 50 messages and says something about them
         if message.content.startswith('!recap'):
@@ -244,7 +306,10 @@ async def on_message(message: DiscordMessage):
 
             async with channel.typing():
                 response_data = await generate_completion_response(
-                    messages=channel_messages, user=message.author
+                    messages=channel_messages,
+                    user=message.author,
+                    channel=channel,
+                    priority=Priority.BACKGROUND,
                 )
 
             if is_last_message_stale(
@@ -284,7 +349,7 @@ async def on_message(message: DiscordMessage):
             return
 
         # moderate the message
-        flagged_str, blocked_str = moderate_message(
+        flagged_str, blocked_str = await moderate_message(
             message=message.content, user=message.author
         )
         await send_moderation_blocked_message(
@@ -326,48 +391,88 @@ async def on_message(message: DiscordMessage):
                 )
             )
 
-        # wait a bit in case user has more messages
-        if SECONDS_DELAY_RECEIVING_MSG > 0:
-            await asyncio.sleep(SECONDS_DELAY_RECEIVING_MSG)
-            if is_last_message_stale(
-                interaction_message=message,
-                last_message=thread.last_message,
-                bot_id=client.user.id,
-            ):
-                # there is another message, so ignore this one
-                return
-
-        logger.info(
-            f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
+        # wait a bit in case user has more messages, a newer message restarts the wait
+        # and cancels a reply that is still being generated
+        reply_scheduler.schedule(
+            thread.id, lambda: reply_in_thread(thread=thread, message=message)
         )
+    except Exception as e:
+        logger.exception(e)
 
-        channel_messages = [
-            discord_message_to_message(message)
-            async for message in thread.history(limit=MAX_THREAD_MESSAGES)
-        ]
-        channel_messages = [x for x in channel_messages if x is not None]
-        channel_messages.reverse()
 
-        # generate the response
-        async with thread.typing():
-            response_data = await generate_completion_response(
-                messages=channel_messages, user=message.author
-            )
+async def reply_in_thread(thread: discord.Thread, message: DiscordMessage):
+    logger.info(
+        f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
+    )
 
-        if is_last_message_stale(
-            interaction_message=message,
-            last_message=thread.last_message,
-            bot_id=client.user.id,
-        ):
-            # there is another message and its not from us, so ignore this response
-            return
+    # the scheduler's task, the streaming callback below runs in other tasks
+    task = asyncio.current_task()
+    channel_messages = await conversation_store.get_messages(thread)
 
-        # send response
-        await process_response(
-            user=message.author, channel=thread, response_data=response_data
+    # generate the response
+    async with thread.typing():
+        response_data = await generate_completion_response(
+            messages=channel_messages,
+            user=message.author,
+            conversation_key=thread.id,
+            stream_to=thread if STREAM_COMPLETIONS else None,
+            channel=thread,
+            on_first_post=lambda: reply_scheduler.detach(thread.id, task),
         )
-    except Exception as e:
-        logger.exception(e)
+
+    # send response
+    reply_scheduler.detach(thread.id, task)
+    await process_response(
+        user=message.author, channel=thread, response_data=response_data
+    )
+
+@client.event
+async def on_message_edit(before: DiscordMessage, after: DiscordMessage):
+    if isinstance(after.channel, discord.Thread):
+        conversation_store.update(after)
+
+
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    # on_message_edit only fires for cached messages, reload the thread otherwise
+    if payload.cached_message is None:
+        conversation_store.discard(payload.channel_id)
+
+
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    conversation_store.remove(payload.channel_id, payload.message_id)
+
+
+@client.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    for message_id in payload.message_ids:
+        conversation_store.remove(payload.channel_id, message_id)
+
+
+@client.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    conversation_store.discard(payload.thread_id)
+
+@client.event
+async def on_guild_role_create(role: discord.Role):
+    roleSync.role_index.invalidate(role.guild.id)
+
+
+@client.event
+async def on_guild_role_delete(role: discord.Role):
+    roleSync.role_index.invalidate(role.guild.id)
+
+
+@client.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    roleSync.role_index.invalidate(after.guild.id)
+
+
+@client.event
+async def on_guild_remove(guild: discord.Guild):
+    roleSync.role_index.invalidate(guild.id)
+
 
 @client.event
 async def on_member_join(member: discord.Member):
@@ -380,7 +485,10 @@ async def on_member_join(member: discord.Member):
 
     async with channel.typing():
         response_data = await generate_completion_response(
-            messages=join_message, user=member.mention
+            messages=join_message,
+            user=member.mention,
+            channel=channel,
+            priority=Priority.BACKGROUND,
         )
     # send response
     await process_response(
@@ -415,17 +523,8 @@ async def process_accounts(int: discord.Interaction, account_id: str):
             "Invalid Account ID format. The account ID must be numbers and follow this format: '0.0.xxxxxx'")
         return
 
-    s3 = boto3.client('s3')
-    bucket_name = 'lost-ones-upload32737-staging'
-    object_key = f'public/discordAccounts/accounts.csv'
-
-    try:
-        # Try to get the CSV from S3
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        csv_content = response['Body'].read().decode('utf-8')
-    except s3.exceptions.NoSuchKey:
-        # If CSV doesn't exist, set csv_content to an empty string
-        csv_content = ""
+    # Try to get the CSV from S3, if it doesn't exist start from an empty one
+    csv_content = await s3helper.run_async(s3helper.read_text_s3, s3helper.ACCOUNTS_KEY) or ""
 
     discord_username = int.user.name
     discord_user_id = int.user.id
@@ -450,14 +549,14 @@ async def process_accounts(int: discord.Interaction, account_id: str):
             for record in account_data.values():
                 csv_writer.writerow(record)
 
-            s3.put_object(
-                Bucket=bucket_name, Key=object_key, Body=csv_out.getvalue()
+            await s3helper.run_async(
+                s3helper.write_text_s3, s3helper.ACCOUNTS_KEY, csv_out.getvalue()
             )
 
         # Fetch NFTs and determine roles (common to both new and existing entries)
-        nfts = getRoles.fetch_from_mirror_node(account_id)
-        matched_records = getRoles.match_nfts_to_discord_helper(nfts)
-        assigned_roles = getRoles.determine_roles(matched_records)
+        # a user usually moves NFTs in right before /assignrole, and the index
+        # only follows marketplace sales between reseeds, so ask the mirror node
+        assigned_roles = await getRoles.roles_for_account(account_id, live=True)
 
         roles_str = '\n'.join(['- ' + role for role in assigned_roles])
 
@@ -487,37 +586,8 @@ async def process_accounts(int: discord.Interaction, account_id: str):
 
 
 async def assign_roles_to_user(member, role_names, guild):
-    # List of possible roles to consider for addition/removal
-    possible_roles = [
-        'Zombie/Spirit',
-        'Hbarbarian GOD',
-        'Hbarbarian Chieftain',
-        'Hbarbarian Berserker',
-        'Hbarbarian',
-        'Gaian Treelord',
-        'Runekin High Council',
-        'Soulweaver Seer',
-        'Zephyr Ace',
-        'ArchAngel Guardian'
-    ]
-
-    # 1. Fetch all the roles that the user currently has.
-    current_roles = member.roles
-
-    # Create a list of role objects for the newly determined roles
-    new_roles = [discord.utils.get(guild.roles, name=role_name) for role_name in role_names]
-
-    # 2. Identify roles to add and roles to remove based on conditions
-    roles_to_add = [role for role in new_roles if role not in current_roles]
-    roles_to_remove = [role for role in current_roles if role.name in possible_roles and role.name not in role_names]
-
-    # 3. Add new roles to the user.
-    for role in roles_to_add:
-        await member.add_roles(role)
-
-    # 4. Remove roles that no longer apply.
-    for role in roles_to_remove:
-        await member.remove_roles(role)
+    roles_to_add, roles_to_remove = roleSync.plan_roles(member, role_names, guild)
+    await roleSync.apply_roles(member, roles_to_add, roles_to_remove)
 
     # Optional: Print information for debugging.
     for role in roles_to_add:
@@ -533,129 +603,196 @@ async def refresh_roles(interaction: discord.Interaction):
         await interaction.response.send_message("This command can only be used in the dev-progress channel")
         return
 
-    s3 = boto3.client('s3')
-    bucket_name = 'lost-ones-upload32737-staging'
-    object_key = f'public/discordAccounts/accounts.csv'
-
-    try:
-        # Try to get the CSV from S3
-        response = s3.get_object(Bucket=bucket_name, Key=object_key)
-        csv_content = response['Body'].read().decode('utf-8')
-
-        # Read CSV content
-        csv_reader = csv.reader(StringIO(csv_content), delimiter='|')
+    # answer within Discord's 3 seconds, progress and the summary edit this reply
+    await interaction.response.defer(thinking=True)
 
-        for row in csv_reader:
-            account_id, discord_username, discord_user_id, _ = row
-            member = discord.utils.get(interaction.guild.members, id=int(discord_user_id))  # get the user from the guild
-            print(member)
+    async def progress(summary):
+        await interaction.edit_original_response(content=summary.render())
 
-            # Fetch NFTs and determine roles
-            nfts = getRoles.fetch_from_mirror_node(account_id)
-            matched_records = getRoles.match_nfts_to_discord_helper(nfts)
-            assigned_roles = getRoles.determine_roles(matched_records)
-
-            print (assigned_roles)
-            # Assign roles to the user
-            if member is None:
-                continue
-
-            await assign_roles_to_user(member, assigned_roles, interaction.guild)
+    try:
+        summary = await roleSync.refresh_guild_roles(interaction.guild, progress=progress)
+        try:
+            await interaction.edit_original_response(content=summary.render(finished=True))
+        except discord.HTTPException:
+            # the interaction token expires after 15 minutes
+            await interaction.channel.send(summary.render(finished=True))
 
     except Exception as e:
-        await interaction.response.send_message(f"An error occurred while refreshing the roles: {str(e)}")
+        await interaction.followup.send(f"An error occurred while refreshing the roles: {str(e)}")
 
 TOKEN_IDS = ['0.0.2235264', '0.0.2371643', '0.0.3721853']
-async def send_embed(channel, event_type, result):
-    max_retries = 3  # maximum number of retries
-    retry_delay = 5  # seconds to wait between retries
+# event type -> (guild id, channel id) the embeds are posted to
+EVENT_CHANNELS = {
+    "Listing": (1053818243732754513, 1147404638774120448),
+    "Sale": (1053818243732754513, 1107273956068704356),
+}
+
+def build_embed(event: NftEvent):
+    if event.event_type == "Listing":
+        if event.txn_type == 'Updated Price':
+            title = f"Updated Listing Price!\n{event.name} #{event.serial_number}"
+        else:
+            title = f"New Listing!\n{event.name} #{event.serial_number}"
+    elif event.event_type == "Sale":
+        title = f"New Sale!\n{event.name} #{event.serial_number}"
+
+    embed = discord.Embed(title=title, color=discord.Color.green())
+    embed.set_image(url=event.image_url)
+    if event.event_type == "Listing":
+        if event.txn_type == 'Updated Price':
+            embed.add_field(name="New Amount", value=f"{event.amount}ℏ", inline=True)
+            embed.add_field(name="Old Amount", value=f"{int(round(event.old_amount, 0))}ℏ", inline=True)
+        else:
+            embed.add_field(name="Amount", value=f"{event.amount}h", inline=True)
+    else:
+        embed.add_field(name="Amount", value=f"{event.amount}h", inline=True)
+    embed.add_field(name="Seller", value=event.account_id_seller, inline=True)
 
-    for attempt in range(max_retries):
-        try:
-            if event_type == "Listing":
-                if result['txn_type'] == 'Updated Price':
-                    title = f"Updated Listing Price!\n{result['name']} #{result['serial_number']}"
-                else:
-                    title = f"New Listing!\n{result['name']} #{result['serial_number']}"
-            elif event_type == "Sale":
-                title = f"New Sale!\n{result['name']} #{result['serial_number']}"
-
-            embed = discord.Embed(title=title, color=discord.Color.green())
-            embed.set_image(url=result['image_url'])
-            if event_type == "Listing":
-                if result['txn_type'] == 'Updated Price':
-                    embed.add_field(name="New Amount", value=f"{result['amount']}ℏ", inline=True)
-                    embed.add_field(name="Old Amount", value=f"{int(round(result['old_amount'], 0))}ℏ", inline=True)
-                else:
-                    embed.add_field(name="Amount", value=f"{result['amount']}h", inline=True)
-            else:
-                embed.add_field(name="Amount", value=f"{result['amount']}h", inline=True)
-            embed.add_field(name="Seller", value=result['account_id_seller'], inline=True)
+    if event.event_type == "Sale":
+        embed.add_field(name="Buyer", value=event.account_id_buyer, inline=True)
 
-            if event_type == "Sale":
-                embed.add_field(name="Buyer", value=result['account_id_buyer'], inline=True)
+    embed.add_field(name="Market", value=f"[{event.market_name}]({event.market_link})", inline=True)
+    embed.add_field(name="Transaction Time", value=f"{event.txn_time} UTC", inline=True)
+    return embed
 
-            embed.add_field(name="Market", value=f"[{result['market_name']}]({result['market_link']})", inline=True)
-            embed.add_field(name="Transaction Time", value=f"{result['txn_time']} UTC", inline=True)
-            await asyncio.sleep(20)
-            await channel.send(embed=embed)
-            break
-        except Exception as e:
-            print(f"Error sending embed: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying in {retry_delay} seconds...")
-                await asyncio.sleep(retry_delay)
-            else:
-                print("Failed to send embed after multiple attempts.")
+def send_embed(channel, event: NftEvent, cancel: asyncio.Event = None) -> asyncio.Future:
+    """Queue the event on the channel's dispatcher, the future resolves to
+    whether it was posted. Once cancel is set the event is dropped unposted."""
+    return embed_dispatcher.submit(channel, build_embed(event), cancel)
 
-async def process_events(guild_id, channel_id, event_type):
-    guild = discord.utils.get(client.guilds, id=guild_id)
+def get_event_channel(event_type):
+    guild_id, channel_id = EVENT_CHANNELS[event_type]
+    guild = client.get_guild(guild_id)
     if not guild:
         print(f"Guild with id {guild_id} not found.")
-        return
+        return None
 
-    channel = discord.utils.get(guild.channels, id=channel_id)
+    channel = guild.get_channel(channel_id)
     if not channel:
         print(f"Channel with id {channel_id} not found in guild {guild.name}.")
+        return None
+    return channel
+
+async def process_events(token_ids):
+    # all collections and event types are collected at once off the event loop
+    batches = await nftEvents.collect_all(token_ids)
+    if not any(batch.events for batch in batches):
+        print(f"No new events for tokens {', '.join(token_ids)}.")
         return
 
-    for token_id in TOKEN_IDS:
-        results = None
-        if event_type == "Listing":
-            results = discordNftListing.execute(token_id)
-        elif event_type == "Sale":
-            results = discordNftSales.execute(token_id)
+    # one stream, oldest first, queued right away. Watermarks are kept per
+    # collection and event type, so after a failed post the rest of that
+    # collection's events of the same type are cancelled and not counted as
+    # delivered: the watermark never skips an event that was not posted, and
+    # what the other channel posted meanwhile still counts
+    cancel = {
+        (batch.token_id, event.event_type): asyncio.Event()
+        for batch in batches
+        for event in batch.events
+    }
+    queued = []
+    for event in nftEvents.merge_events(batches):
+        group = (event.token_id, event.event_type)
+        channel = get_event_channel(event.event_type)
+        if channel is None:
+            cancel[group].set()
+        queued.append((event, send_embed(channel, event, cancel[group]) if channel else None))
+    print(f"Queued {len(queued)} events, {embed_dispatcher.queue_depth()} embeds waiting to be posted.")
+
+    delivered = {batch.token_id: [] for batch in batches}
+    stopped = set()
+    for event, posted in queued:
+        group = (event.token_id, event.event_type)
+        if posted is None or not await posted:
+            stopped.add(group)
+        elif group not in stopped:
+            delivered[event.token_id].append(event)
+
+    await asyncio.gather(
+        *(s3helper.run_async(batch.commit, delivered[batch.token_id]) for batch in batches)
+    )
+
+    # a sale moved NFTs, update the roles of the buyers and sellers right away
+    if any(event.event_type == "Sale" for batch in batches for event in batch.events):
+        task = asyncio.create_task(reconcile_roles())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
-        if not results:
-            print(f"No new {event_type.lower()}s for token {token_id}.")
-            continue
-        for result in results:
-            await send_embed(channel, event_type, result)
+@tasks.loop(minutes=30)
+async def refill_reply_pools():
+    # replaces replies that expired without being used
+    gm_reply_pool.schedule_refill()
 
-@tasks.loop(minutes=10)
+# keeps fire-and-forget tasks referenced until they finish
+background_tasks = set()
+
+async def reconcile_roles():
+    # move the holdings index forward and refresh roles of the holders it changed
+    try:
+        changed = await getRoles.holdings_index.advance()
+        if not changed:
+            return
+        print(f"Holdings changed for {len(changed)} accounts.")
+        guilds = [guild for guild in client.guilds if not should_block(guild=guild)]
+        for summary in await roleSync.reconcile_changed_accounts(guilds, changed):
+            print(summary.render(finished=True))
+    except Exception as e:
+        # keep going, roles fall back to the mirror node until the index loads
+        logger.exception(e)
+
+@tasks.loop(minutes=HOLDINGS_ADVANCE_MINUTES)
+async def advance_holdings():
+    await reconcile_roles()
+
+nft_feed = FeedRunner(process=process_events, token_ids=TOKEN_IDS)
+nft_trigger = make_trigger()
+
+@tasks.loop(minutes=NFT_POLL_MINUTES)
 async def discord_nfts():
-    LISTING_GUILD_ID = 1053818243732754513
-    LISTING_CHANNEL_ID = 1147404638774120448
-    SALE_GUILD_ID = 1053818243732754513
-    SALE_CHANNEL_ID = 1107273956068704356
+    # polling fallback, the trigger (if any) notifies changed collections in between
+    nft_feed.notify()
 
-    await process_events(LISTING_GUILD_ID, LISTING_CHANNEL_ID, "Listing")
-    await process_events(SALE_GUILD_ID, SALE_CHANNEL_ID, "Sale")
 @tree.command(name="nftslisted", description="Retrieve Listed Accounts")
 @discord.app_commands.choices(option=[
         discord.app_commands.Choice(name="Community Founders Pass", value="0.0.2235264"),
         discord.app_commands.Choice(name="Alixon Airdrop", value="0.0.2371643"),
         discord.app_commands.Choice(name="The Lost Ones", value="0.0.3721853")
+    ],
+    sort=[
+        discord.app_commands.Choice(name="NFTs Listed", value="NFTs Listed"),
+        discord.app_commands.Choice(name="Lowest List Price", value="lowest_list_price"),
+        discord.app_commands.Choice(name="Sale Volume", value="total_sale_volume"),
+        discord.app_commands.Choice(name="Buy Volume", value="total_buy_volume"),
+        discord.app_commands.Choice(name="Mint Volume", value="total_mint_volume"),
+        discord.app_commands.Choice(name="Name", value="name"),
+        discord.app_commands.Choice(name="Account", value="account_id"),
     ])
-async def admin_listed(interaction: discord.Interaction, option: discord.app_commands.Choice[str]):
+@discord.app_commands.describe(sort="Column to sort by", ascending="Smallest first", page="Page of 10 accounts")
+async def admin_listed(
+    interaction: discord.Interaction,
+    option: discord.app_commands.Choice[str],
+    sort: discord.app_commands.Choice[str] = None,
+    ascending: bool = False,
+    page: int = 1,
+):
     allowed_channel_id = 1068830862617096303
     if interaction.channel_id != allowed_channel_id:
         await interaction.response.send_message("This command can only be used in the allowed channel", hidden=True)
         return
 
     try:
-        listings = discordAdminListing.execute(option.value)
-        await interaction.response.send_message(f"```{listings.head(10).to_string(index=False)}```")
+        # served from the materialized table, only revalidated against S3 now and then
+        listings, pages = await s3helper.run_async(
+            discordAdminListing.page,
+            option.value,
+            sort_by=sort.value if sort else 'NFTs Listed',
+            descending=not ascending,
+            page_number=page,
+        )
+        page = min(max(1, page), pages)
+        await interaction.response.send_message(
+            f"```{listings.to_string(index=False)}```Page {page} of {pages}"
+        )
 
     except KeyError:
         await interaction.response.send_message(f"No token ID found for {token}", hidden=True)
@@ -671,15 +808,11 @@ async def admin_listed(interaction: discord.Interaction, wallet_id: str, serial_
         return
 
     try:
-        # Initialize boto3 client for S3
-        s3 = boto3.client('s3')
-        bucket_name = 'lost-ones-upload32737-staging'
-        object_key = 'public/discordAccounts/mortalChallenge.csv'
-
         # Fetch the existing CSV data
         try:
-            response = s3.get_object(Bucket=bucket_name, Key=object_key)
-            csv_content = response['Body'].read().decode('utf-8')
+            csv_content = await s3helper.run_async(
+                s3helper.read_text_s3, s3helper.MORTAL_CHALLENGE_KEY
+            )
             csv_reader = csv.reader(StringIO(csv_content), delimiter='|')
             existing_data = {row[1]: row for row in csv_reader}  # Keyed by Discord Name for easier lookup
         except Exception as e:
@@ -713,7 +846,9 @@ async def admin_listed(interaction: discord.Interaction, wallet_id: str, serial_
                 csv_writer.writerow(entry)
 
         # Upload the updated CSV to S3
-        s3.put_object(Bucket=bucket_name, Key=object_key, Body=csv_out.getvalue())
+        await s3helper.run_async(
+            s3helper.write_text_s3, s3helper.MORTAL_CHALLENGE_KEY, csv_out.getvalue()
+        )
 
         await interaction.response.send_message("Your serial number has been added successfully!")
 
@@ -721,5 +856,5 @@ async def admin_listed(interaction: discord.Interaction, wallet_id: str, serial_
         await interaction.response.send_message(f"An error occurred: {str(e)}")
 
 
-
-client.run(DISCORD_BOT_TOKEN)
+if __name__ == "__main__":
+    client.run(DISCORD_BOT_TOKEN)
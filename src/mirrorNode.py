@@ -0,0 +1,137 @@
+import asyncio
+import os
+import random
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urljoin
+import aiohttp
+from src.utils import logger
+
+MIRROR_NODE_URL = os.environ.get('MIRROR_NODE_URL', 'https://mainnet-public.mirrornode.hedera.com')
+# seconds for a whole request, including reading the body
+MIRROR_NODE_TIMEOUT_SECONDS = float(os.environ.get('MIRROR_NODE_TIMEOUT_SECONDS', '10'))
+MIRROR_NODE_RETRIES = int(os.environ.get('MIRROR_NODE_RETRIES', '3'))
+MIRROR_NODE_BACKOFF_SECONDS = 0.5
+# requests in flight at once, also the size of the connection pool
+MIRROR_NODE_CONCURRENCY = int(os.environ.get('MIRROR_NODE_CONCURRENCY', '8'))
+MIRROR_NODE_PAGE_SIZE = 100
+
+
+class MirrorNodeError(Exception):
+    pass
+
+
+class MirrorNodeClient:
+    """Hedera mirror node REST client on one keep-alive aiohttp session.
+    Pages are followed with a loop over links.next, failed requests (network
+    errors, timeouts, 429 and 5xx) are retried with a jittered backoff and at
+    most `concurrency` requests run at the same time."""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout_seconds: float,
+        retries: int,
+        backoff_seconds: float,
+        concurrency: int,
+        page_size: int,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.timeout_seconds = timeout_seconds
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created on first use so it belongs to the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout_seconds),
+                headers={'Accept': 'application/json'},
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get_json(self, path: str, params: Optional[Dict[str, str]] = None) -> dict:
+        """GET a path (or a links.next value) below the base url. Client errors
+        other than 429, like an unknown account, return an empty dict."""
+        session = self._get_session()
+        url = urljoin(self.base_url + '/', path.lstrip('/'))
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    async with session.get(url, params=params) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status != 429 and response.status < 500:
+                            logger.info(f"Mirror node returned {response.status} for {url}")
+                            return {}
+                        retry_after = response.headers.get('Retry-After')
+                        error = f"HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt == self.retries:
+                raise MirrorNodeError(f"GET {url} failed after {attempt + 1} attempts: {error}")
+            delay = self.backoff_seconds * 2**attempt
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            delay += random.uniform(0, delay)
+            logger.info(f"Mirror node {error} for {url}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def paginate(self, path: str, key: str, params: Optional[Dict[str, str]] = None) -> List[dict]:
+        """All items under `key` across the pages of a list endpoint."""
+        items: List[dict] = []
+        page = await self.get_json(path, params)
+        while True:
+            items += page.get(key, [])
+            next_path = (page.get('links') or {}).get('next')
+            if not next_path:
+                return items
+            # links.next already carries every query parameter
+            page = await self.get_json(next_path)
+
+    async def account_nfts(self, account_id: str, token_ids: Optional[Iterable[str]] = None) -> List[dict]:
+        """NFTs held by an account. With token_ids only those tokens are asked
+        for, filtered by the mirror node, one listing per token fetched at the
+        same time."""
+        path = f'/api/v1/accounts/{account_id}/nfts'
+        if token_ids is None:
+            return await self.paginate(path, 'nfts', {'limit': str(self.page_size)})
+        pages = await asyncio.gather(
+            *(
+                self.paginate(path, 'nfts', {'limit': str(self.page_size), 'token.id': token_id})
+                for token_id in token_ids
+            )
+        )
+        return [nft for page in pages for nft in page]
+
+    async def nft(self, token_id: str, serial_number: int) -> dict:
+        """One NFT with its current owner, {} if the mirror node does not know it."""
+        return await self.get_json(f'/api/v1/tokens/{token_id}/nfts/{serial_number}')
+
+    async def token_nfts(self, token_id: str) -> List[dict]:
+        """Every NFT of a token with its current owner."""
+        return await self.paginate(
+            f'/api/v1/tokens/{token_id}/nfts', 'nfts', {'limit': str(self.page_size)}
+        )
+
+
+mirror_node = MirrorNodeClient(
+    base_url=MIRROR_NODE_URL,
+    timeout_seconds=MIRROR_NODE_TIMEOUT_SECONDS,
+    retries=MIRROR_NODE_RETRIES,
+    backoff_seconds=MIRROR_NODE_BACKOFF_SECONDS,
+    concurrency=MIRROR_NODE_CONCURRENCY,
+    page_size=MIRROR_NODE_PAGE_SIZE,
+)
@@ -2,20 +2,133 @@ from src.constants import (
     SERVER_TO_MODERATION_CHANNEL,
     MODERATION_VALUES_FOR_BLOCKED,
     MODERATION_VALUES_FOR_FLAGGED,
+    MODERATION_BATCH_WINDOW_SECONDS,
+    MODERATION_MAX_BATCH_SIZE,
+    MODERATION_CACHE_SIZE,
 )
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 import openai
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 import discord
 from src.utils import logger
 
 
-def moderate_message(
+class ModerationService:
+    """Gathers concurrent moderation requests into one batched api call and
+    keeps an LRU cache of category scores keyed by content hash."""
+
+    def __init__(self, batch_window: float, max_batch_size: int, cache_size: int):
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self._pending: "OrderedDict[str, Tuple[str, asyncio.Future]]" = OrderedDict()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.api_seconds = 0.0
+
+    async def category_scores(self, text: str) -> Dict[str, float]:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            self.hits += 1
+            return cached
+
+        self.misses += 1
+        pending = self._pending.get(digest)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = (text, loop.create_future())
+            self._pending[digest] = pending
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        # shield so one cancelled caller does not fail everyone waiting on the batch
+        return await asyncio.shield(pending[1])
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "batches": self.batches,
+            "avg_batch_seconds": self.api_seconds / self.batches if self.batches else 0.0,
+            "cached": len(self._cache),
+        }
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch = list(self._pending.items())
+        self._pending = OrderedDict()
+        task = asyncio.create_task(self._send_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(self, batch: List[Tuple[str, Tuple[str, asyncio.Future]]]):
+        start = time.monotonic()
+        try:
+            moderation_response = await openai.Moderation.acreate(
+                input=[text for _, (text, _) in batch], model="text-moderation-latest"
+            )
+        except Exception as e:
+            for _, (_, future) in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        elapsed = time.monotonic() - start
+        self.batches += 1
+        self.api_seconds += elapsed
+
+        results = list(moderation_response.results)
+        if len(results) != len(batch):
+            logger.error(f"moderation returned {len(results)} results for a batch of {len(batch)}")
+        try:
+            for (digest, (_, future)), result in zip(batch, results):
+                category_scores = dict(result["category_scores"] or {})
+                self._cache[digest] = category_scores
+                if not future.done():
+                    future.set_result(category_scores)
+        finally:
+            # anyone still waiting got no result, fail them instead of hanging
+            for _, (_, future) in batch:
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError(f"no moderation result ({len(results)} results for {len(batch)} inputs)")
+                    )
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        stats = self.stats()
+        logger.info(
+            f"moderation batch of {len(batch)} took {elapsed * 1000:.0f}ms, "
+            f"cache hit rate {stats['hit_rate']:.0%} ({stats['hits']}/{stats['hits'] + stats['misses']})"
+        )
+
+
+moderation_service = ModerationService(
+    batch_window=MODERATION_BATCH_WINDOW_SECONDS,
+    max_batch_size=MODERATION_MAX_BATCH_SIZE,
+    cache_size=MODERATION_CACHE_SIZE,
+)
+
+
+async def moderate_message(
     message: str, user: str
 ) -> Tuple[str, str]:  # [flagged_str, blocked_str]
-    moderation_response = openai.Moderation.create(
-        input=message, model="text-moderation-latest"
-    )
-    category_scores = moderation_response.results[0]["category_scores"] or {}
+    category_scores = await moderation_service.category_scores(message)
 
     blocked_str = ""
     flagged_str = ""
@@ -0,0 +1,31 @@
+import numpy as np
+
+COLLECTION_NAMES = {
+    '0.0.2235264': 'Community Founders Pass',
+    '0.0.2371643': 'The Alixon Collection',
+    '0.0.3721853': 'The Lost Ones',
+    '0.0.3954030': 'TrizTazz - Collection 1 : 1',
+    '0.0.4350721': 'The Tools',
+}
+
+IMAGE_BASE_URL = 'https://lost-ones-upload32737-staging.s3.amazonaws.com/public/data-analytics'
+
+
+def latest_per_serial(df):
+    """Latest row by txn_time for each serial_number, ordered by serial_number."""
+    latest = df.sort_values('txn_time', ascending=False, kind='mergesort')
+    latest = latest.drop_duplicates('serial_number', keep='first')
+    return latest.sort_values('serial_number', kind='mergesort')
+
+
+def add_display_columns(df, token_id):
+    """Add the collection name, image url and market link columns used in the embeds."""
+    serials = df['serial_number'].astype(str)
+    df['name'] = COLLECTION_NAMES.get(token_id, '')
+    df['image_url'] = f'{IMAGE_BASE_URL}/{token_id}/images/' + serials + '.webp'
+    df['market_link'] = np.where(
+        df['market_name'] == 'SentX',
+        f'https://sentx.io/nft-marketplace/{token_id}/' + serials,
+        f'https://zuse.market/collection/{token_id}',
+    )
+    return df
@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional
+
+import src.discordNftListing as discordNftListing
+import src.discordNftSales as discordNftSales
+import src.s3helper as s3helper
+
+CONFIG_FILE = 'nft_config.json'
+WATERMARK_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Worker processes running the pandas part of collect_all, 0 runs it on the
+# storage threads instead
+NFT_PROCESS_WORKERS = int(os.environ.get('NFT_PROCESS_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+@dataclass
+class NftEvent:
+    event_type: str
+    token_id: str
+    name: str
+    serial_number: int
+    txn_time: datetime
+    market_name: str
+    market_link: str
+    image_url: str
+    amount: object
+    account_id_seller: str
+    account_id_buyer: Optional[str] = None
+    txn_type: Optional[str] = None
+    old_amount: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class EventSource:
+    event_type: str
+    # key in nft_config.json holding the txn_time of the last event sent
+    watermark: str
+    # (token_id, config) -> records newer than the watermark, latest per serial
+    collect: Callable[[str, dict], List[dict]]
+
+
+# add new event types here, they are collected in the same pass per collection
+EVENT_SOURCES = [
+    EventSource("Listing", 'last_discord_listings_ts', discordNftListing.discord_nft_listings),
+    EventSource("Sale", 'last_discord_sales_ts', discordNftSales.discord_nft_sales),
+]
+
+
+@dataclass
+class CollectionBatch:
+    """New events of one collection and the config they were read against.
+    Watermarks only move when commit() is called with the delivered events.
+    commit() re-reads the config and only changes the watermark keys, so
+    anything else written to the config meanwhile is kept."""
+
+    token_id: str
+    config: dict
+    events: List[NftEvent] = field(default_factory=list)
+
+    def add(self, source: EventSource, records: List[dict]):
+        for record in records:
+            self.events.append(NftEvent(event_type=source.event_type, token_id=self.token_id, **record))
+
+    def commit(self, delivered: List[NftEvent]) -> bool:
+        # the next run reads txn_time > watermark, so a watermark only moves up
+        # to the second before the oldest event of its type left undelivered:
+        # delivered events sharing that second are posted again rather than an
+        # undelivered one skipped
+        delivered_ids = {id(event) for event in delivered}
+        pending: Dict[str, datetime] = {}
+        for event in self.events:
+            if id(event) not in delivered_ids:
+                second = event.txn_time.replace(microsecond=0)
+                if event.event_type not in pending or second < pending[event.event_type]:
+                    pending[event.event_type] = second
+
+        watermarks: Dict[str, datetime] = {}
+        for event in delivered:
+            if event.event_type in pending and event.txn_time >= pending[event.event_type]:
+                continue
+            if event.event_type not in watermarks or event.txn_time > watermarks[event.event_type]:
+                watermarks[event.event_type] = event.txn_time
+        if not watermarks:
+            return False
+
+        # read_config falls back to defaults when S3 fails, never write those
+        # back over the real config
+        try:
+            text = s3helper.read_text_s3(s3helper.data_key(self.token_id, CONFIG_FILE))
+        except Exception as e:
+            print(f"Error re-reading {CONFIG_FILE} for token {self.token_id}, watermarks not moved: {e}")
+            return False
+        config = json.loads(text) if text is not None else dict(self.config)
+        for source in EVENT_SOURCES:
+            if source.event_type in watermarks:
+                config[source.watermark] = watermarks[source.event_type].strftime(WATERMARK_FORMAT)
+        s3helper.upload_json_s3(self.token_id, CONFIG_FILE, config)
+        self.config = config
+        return True
+
+
+def collect(token_id: str, sources: List[EventSource] = EVENT_SOURCES) -> CollectionBatch:
+    """Read the collection config once and gather the new events of every
+    source, oldest first."""
+    config = read_config(token_id)
+    batch = CollectionBatch(token_id=token_id, config=config)
+    for source in sources:
+        batch.add(source, source.collect(token_id, config))
+    batch.events.sort(key=lambda e: e.txn_time)
+    return batch
+
+
+def read_config(token_id: str) -> dict:
+    return s3helper.read_json_s3(token_id, CONFIG_FILE)
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool for the collectors, started on first use. Workers are spawned rather
+    than forked so they do not inherit the event loop or held locks."""
+    global _process_pool
+    if NFT_PROCESS_WORKERS <= 0:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=NFT_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _process_pool
+
+
+def _reset_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+async def _run_collector(source: EventSource, token_id: str, config: dict) -> List[dict]:
+    pool = get_process_pool()
+    if pool is None:
+        return await s3helper.run_async(source.collect, token_id, config)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, source.collect, token_id, config)
+    except BrokenProcessPool:
+        # a worker died, start a fresh pool next time
+        _reset_process_pool()
+        raise
+
+
+async def collect_all(token_ids: List[str], sources: List[EventSource] = EVENT_SOURCES) -> List[CollectionBatch]:
+    """collect() for every collection at once. Configs are read on the storage
+    threads, every (collection, source) pair runs on the process pool. A
+    collection whose config or collectors fail is left out of the result, so
+    its watermarks stay where they are."""
+    configs = await asyncio.gather(
+        *(s3helper.run_async(read_config, token_id) for token_id in token_ids),
+        return_exceptions=True,
+    )
+
+    jobs = []
+    for token_id, config in zip(token_ids, configs):
+        if isinstance(config, BaseException):
+            print(f"Error reading {CONFIG_FILE} for token {token_id}: {config}")
+            continue
+        for source in sources:
+            jobs.append((token_id, config, source))
+
+    results = await asyncio.gather(
+        *(_run_collector(source, token_id, config) for token_id, config, source in jobs),
+        return_exceptions=True,
+    )
+
+    batches: Dict[str, CollectionBatch] = {}
+    failed = set()
+    for (token_id, config, source), records in zip(jobs, results):
+        if isinstance(records, BaseException):
+            print(f"Error collecting {source.event_type.lower()}s for token {token_id}: {records!r}")
+            failed.add(token_id)
+            continue
+        batches.setdefault(token_id, CollectionBatch(token_id=token_id, config=config)).add(source, records)
+
+    ordered = []
+    for token_id in token_ids:
+        if token_id in batches and token_id not in failed:
+            batch = batches[token_id]
+            batch.events.sort(key=lambda e: e.txn_time)
+            ordered.append(batch)
+    return ordered
+
+
+def merge_events(batches: List[CollectionBatch]) -> Iterator[NftEvent]:
+    """Events of all collections as one stream, oldest first."""
+    return heapq.merge(*(batch.events for batch in batches), key=lambda e: e.txn_time)
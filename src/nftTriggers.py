@@ -0,0 +1,240 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import unquote_plus
+import boto3
+from src.constants import (
+    NFT_TRIGGER,
+    NFT_TRIGGER_SQS_URL,
+    NFT_TRIGGER_DIR,
+    NFT_DEBOUNCE_SECONDS,
+    NFT_DEBOUNCE_MAX_SECONDS,
+)
+from src.utils import logger
+
+# objects the listing and sales collectors read, a change to any of them is news
+WATCHED_FILES = ('nft_listings.csv', 'nft_transactions.csv')
+
+# seconds a failed trigger waits before it starts listening again
+TRIGGER_RESTART_SECONDS = 30
+
+Notify = Callable[[Optional[str]], None]
+
+
+def token_from_key(key: str) -> Optional[str]:
+    """public/data-analytics/<token_id>/nft_listings.csv -> token_id"""
+    parts = key.replace(os.sep, '/').split('/')
+    if len(parts) >= 2 and parts[-1] in WATCHED_FILES:
+        return parts[-2]
+    return None
+
+
+class ChangeTrigger:
+    """Source of change notifications. run() calls notify(token_id) for every
+    collection whose data changed, notify(None) means all of them."""
+
+    name = "trigger"
+
+    async def run(self, notify: Notify):
+        raise NotImplementedError
+
+
+class QueueTrigger(ChangeTrigger):
+    """In-process notifications, for whatever writes the data in the same
+    process or as a stand-in for a real queue."""
+
+    name = "queue"
+
+    def __init__(self):
+        self.queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+
+    def put(self, token_id: Optional[str] = None):
+        self.queue.put_nowait(token_id)
+
+    async def run(self, notify: Notify):
+        while True:
+            notify(await self.queue.get())
+
+
+class DirectoryTrigger(ChangeTrigger):
+    """Watches a local copy of the data laid out like the bucket
+    (<path>/<token_id>/nft_listings.csv) by comparing mtime and size."""
+
+    name = "directory"
+
+    def __init__(self, path: str, interval: float = 1.0):
+        self.path = path
+        self.interval = interval
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        seen = {}
+        for root, _, files in os.walk(self.path):
+            for filename in files:
+                if filename in WATCHED_FILES:
+                    full = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(full)
+                    except FileNotFoundError:
+                        continue
+                    seen[full] = (stat.st_mtime_ns, stat.st_size)
+        return seen
+
+    async def run(self, notify: Notify):
+        loop = asyncio.get_running_loop()
+        known = await loop.run_in_executor(None, self._scan)
+        while True:
+            await asyncio.sleep(self.interval)
+            current = await loop.run_in_executor(None, self._scan)
+            for path, state in current.items():
+                if known.get(path) != state:
+                    notify(token_from_key(path))
+            known = current
+
+
+class SqsTrigger(ChangeTrigger):
+    """S3 event notifications delivered to an SQS queue, directly or through
+    SNS. Long polling keeps the queue calls to one per wait_seconds when
+    nothing changes."""
+
+    name = "sqs"
+
+    def __init__(self, queue_url: str, wait_seconds: int = 20):
+        self.queue_url = queue_url
+        self.wait_seconds = wait_seconds
+        self._client = None
+
+    def _receive(self) -> List[dict]:
+        if self._client is None:
+            self._client = boto3.client('sqs')
+        response = self._client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=self.wait_seconds,
+        )
+        messages = response.get('Messages', [])
+        if messages:
+            self._client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {'Id': str(i), 'ReceiptHandle': m['ReceiptHandle']}
+                    for i, m in enumerate(messages)
+                ],
+            )
+        return messages
+
+    @staticmethod
+    def keys(message: dict) -> Iterable[str]:
+        body = json.loads(message.get('Body') or '{}')
+        if 'Message' in body and isinstance(body['Message'], str):
+            body = json.loads(body['Message'])  # wrapped by SNS
+        for record in body.get('Records', []):
+            key = record.get('s3', {}).get('object', {}).get('key')
+            if key:
+                yield unquote_plus(key)
+
+    async def run(self, notify: Notify):
+        loop = asyncio.get_running_loop()
+        while True:
+            # long poll on the default executor, not on the storage threads
+            for message in await loop.run_in_executor(None, self._receive):
+                try:
+                    keys = list(self.keys(message))
+                except ValueError:
+                    logger.info(f"Ignoring unreadable notification {message.get('MessageId')}")
+                    continue
+                for key in keys:
+                    token_id = token_from_key(key)
+                    if token_id:
+                        notify(token_id)
+
+
+def make_trigger(kind: str = NFT_TRIGGER) -> Optional[ChangeTrigger]:
+    if not kind:
+        return None
+    if kind == "sqs":
+        if not NFT_TRIGGER_SQS_URL:
+            raise ValueError("NFT_TRIGGER=sqs needs NFT_TRIGGER_SQS_URL")
+        return SqsTrigger(NFT_TRIGGER_SQS_URL)
+    if kind == "directory":
+        if not NFT_TRIGGER_DIR:
+            raise ValueError("NFT_TRIGGER=directory needs NFT_TRIGGER_DIR")
+        return DirectoryTrigger(NFT_TRIGGER_DIR)
+    if kind == "queue":
+        return QueueTrigger()
+    raise ValueError(f"Unknown NFT_TRIGGER {kind!r}")
+
+
+class FeedRunner:
+    """Runs process(token_ids) for the collections that were notified. A burst
+    of notifications is folded into one run, started once they have been
+    quiet for debounce_seconds (at most max_delay_seconds after the first).
+    Runs never overlap, notifications that arrive during a run start the
+    next one."""
+
+    def __init__(
+        self,
+        process: Callable[[List[str]], Awaitable[None]],
+        token_ids: List[str],
+        debounce_seconds: float = NFT_DEBOUNCE_SECONDS,
+        max_delay_seconds: float = NFT_DEBOUNCE_MAX_SECONDS,
+    ):
+        self.process = process
+        self.token_ids = token_ids
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._dirty: Set[str] = set()
+        self._first_notified = 0.0
+        self._last_notified = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._trigger_task: Optional[asyncio.Task] = None
+
+    def notify(self, token_id: Optional[str] = None):
+        if token_id is None:
+            changed = set(self.token_ids)
+        elif token_id in self.token_ids:
+            changed = {token_id}
+        else:
+            return
+        now = time.monotonic()
+        if not self._dirty:
+            self._first_notified = now
+        self._last_notified = now
+        self._dirty |= changed
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def start_trigger(self, trigger: ChangeTrigger):
+        if self._trigger_task is None or self._trigger_task.done():
+            self._trigger_task = asyncio.create_task(self._listen(trigger))
+
+    async def _listen(self, trigger: ChangeTrigger):
+        logger.info(f"Listening for NFT data changes with the {trigger.name} trigger")
+        while True:
+            try:
+                await trigger.run(self.notify)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(e)
+            # the polling fallback covers the gap
+            await asyncio.sleep(TRIGGER_RESTART_SECONDS)
+
+    async def _run(self):
+        while self._dirty:
+            while True:
+                now = time.monotonic()
+                wait = min(
+                    self._last_notified + self.debounce_seconds,
+                    self._first_notified + self.max_delay_seconds,
+                ) - now
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            token_ids = [t for t in self.token_ids if t in self._dirty]
+            self._dirty.clear()
+            try:
+                await self.process(token_ids)
+            except Exception as e:
+                logger.exception(e)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+from src.admission import Priority
+from src.base import Message
+from src.completion import CompletionResult, generate_completion_response
+from src.utils import logger
+
+
+@dataclass
+class PooledReply:
+    text: str
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class ReplyPool:
+    """Replies generated ahead of time for a prompt that is always the same,
+    like !gm. Replies only enter the pool when moderation let them through
+    unflagged, expire after ttl_seconds and are not repeated in a channel."""
+
+    def __init__(
+        self,
+        name: str,
+        prompt: List[Message],
+        target_size: int,
+        ttl_seconds: int,
+        recent_per_channel: int,
+    ):
+        self.name = name
+        self.prompt = prompt
+        self.target_size = target_size
+        self.ttl_seconds = ttl_seconds
+        self.recent_per_channel = recent_per_channel
+        self._replies: Deque[PooledReply] = deque()
+        self._recent: Dict[int, Deque[str]] = {}
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def size(self) -> int:
+        return len(self._replies)
+
+    def take(self, channel_id: int) -> Optional[str]:
+        self._drop_expired()
+        recent = self._recent.setdefault(channel_id, deque(maxlen=self.recent_per_channel))
+        for i, reply in enumerate(self._replies):
+            if reply.text not in recent:
+                del self._replies[i]
+                recent.append(reply.text)
+                return reply.text
+        return None
+
+    def schedule_refill(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self.refill())
+
+    async def refill(self):
+        self._drop_expired()
+        attempts = 0
+        while len(self._replies) < self.target_size and attempts < 2 * self.target_size:
+            attempts += 1
+            response_data = await generate_completion_response(
+                messages=self.prompt, user=f"{self.name}-pool", priority=Priority.BACKGROUND
+            )
+            if response_data.status is not CompletionResult.OK:
+                # errors and moderated replies are retried on the next refill
+                logger.info(f"{self.name} pool refill stopped: {response_data.status} {response_data.status_text}")
+                break
+            text = response_data.reply_text
+            if text and all(r.text != text for r in self._replies):
+                self._replies.append(PooledReply(text=text))
+        logger.info(f"{self.name} pool has {len(self._replies)}/{self.target_size} replies")
+
+    def _drop_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._replies and self._replies[0].created_at < cutoff:
+            self._replies.popleft()
@@ -0,0 +1,192 @@
+import asyncio
+import csv
+import time
+from dataclasses import dataclass, field
+from io import StringIO
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import discord
+from src import getRoles
+from src.constants import ROLE_REFRESH_CONCURRENCY, ROLE_REFRESH_PROGRESS_SECONDS
+from src.utils import logger
+import src.s3helper as s3helper
+
+
+class RoleIndex:
+    """Role name -> Role per guild, built from guild.roles on first use. The
+    role create, update and delete events drop the guild's index so the next
+    lookup sees the change. Like discord.utils.get, the first role in
+    guild.roles order wins when names repeat."""
+
+    def __init__(self):
+        self._guilds: Dict[int, Dict[str, discord.Role]] = {}
+
+    def get(self, guild: discord.Guild, name: str) -> Optional[discord.Role]:
+        index = self._guilds.get(guild.id)
+        if index is None:
+            index = {}
+            for role in guild.roles:
+                index.setdefault(role.name, role)
+            self._guilds[guild.id] = index
+        return index.get(name)
+
+    def invalidate(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+
+
+role_index = RoleIndex()
+
+
+def plan_roles(member: discord.Member, role_names: List[str], guild: discord.Guild) -> Tuple[List[discord.Role], List[discord.Role]]:
+    """(roles to add, roles to remove) to bring the member's managed roles in
+    line with role_names. Roles missing from the guild are skipped."""
+    current_roles = member.roles
+    new_roles = [role_index.get(guild, role_name) for role_name in role_names]
+    roles_to_add = [role for role in new_roles if role is not None and role not in current_roles]
+    roles_to_remove = [
+        role for role in current_roles
+        if role.name in getRoles.MANAGED_ROLES and role.name not in role_names
+    ]
+    return roles_to_add, roles_to_remove
+
+
+async def apply_roles(member: discord.Member, roles_to_add: List[discord.Role], roles_to_remove: List[discord.Role]):
+    """One member edit with the final role set instead of a request per role."""
+    if not roles_to_add and not roles_to_remove:
+        return
+    removed = set(roles_to_remove)
+    final_roles = [role for role in member.roles if not role.is_default() and role not in removed]
+    final_roles += [role for role in roles_to_add if role not in final_roles]
+    await member.edit(roles=final_roles, reason="NFT holdings changed")
+
+
+def read_registered_accounts(csv_content: str) -> Dict[int, str]:
+    """discord user id -> account id from accounts.csv. A user registered with
+    several wallets keeps the last one, like applying the rows in order did."""
+    accounts = {}
+    for row in csv.reader(StringIO(csv_content), delimiter='|'):
+        if len(row) < 3:
+            continue
+        account_id, _, discord_user_id = row[:3]
+        try:
+            accounts[int(discord_user_id)] = account_id
+        except ValueError:
+            continue
+    return accounts
+
+
+@dataclass
+class RefreshSummary:
+    accounts: int = 0
+    done: int = 0
+    missing_members: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    roles_added: int = 0
+    roles_removed: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def render(self, finished: bool = False) -> str:
+        elapsed = time.monotonic() - self.started_at
+        head = "Role refresh finished" if finished else "Refreshing roles"
+        return (
+            f"{head}: {self.done}/{self.accounts} accounts in {elapsed:.0f}s\n"
+            f"- {self.changed} members updated ({self.roles_added} roles added, {self.roles_removed} removed)\n"
+            f"- {self.unchanged} already up to date\n"
+            f"- {self.missing_members} not in this server\n"
+            f"- {self.failed} failed"
+        )
+
+
+class RoleRefresh:
+    """Recomputes the roles of every registered account in a guild. Holdings
+    are fetched for up to `concurrency` accounts at once and Discord is only
+    called for members whose role set changes. `progress` is called with the
+    running summary at most every progress_seconds."""
+
+    def __init__(
+        self,
+        guild: discord.Guild,
+        accounts: Dict[int, str],
+        concurrency: int = ROLE_REFRESH_CONCURRENCY,
+        progress: Optional[Callable[["RefreshSummary"], Awaitable[None]]] = None,
+        progress_seconds: float = ROLE_REFRESH_PROGRESS_SECONDS,
+    ):
+        self.guild = guild
+        self.accounts = accounts
+        self.concurrency = concurrency
+        self.progress = progress
+        self.progress_seconds = progress_seconds
+        self.summary = RefreshSummary(accounts=len(accounts))
+        self._last_progress = 0.0
+
+    async def _report(self):
+        if self.progress is None:
+            return
+        now = time.monotonic()
+        if now - self._last_progress < self.progress_seconds:
+            return
+        self._last_progress = now
+        try:
+            await self.progress(self.summary)
+        except Exception as e:
+            logger.info(f"Could not report role refresh progress: {e}")
+
+    async def _refresh_member(self, semaphore: asyncio.Semaphore, user_id: int, account_id: str):
+        summary = self.summary
+        member = self.guild.get_member(user_id)
+        try:
+            if member is None:
+                summary.missing_members += 1
+                return
+            async with semaphore:
+                role_names = await getRoles.roles_for_account(account_id)
+                roles_to_add, roles_to_remove = plan_roles(member, role_names, self.guild)
+                if not roles_to_add and not roles_to_remove:
+                    summary.unchanged += 1
+                    return
+                await apply_roles(member, roles_to_add, roles_to_remove)
+            summary.changed += 1
+            summary.roles_added += len(roles_to_add)
+            summary.roles_removed += len(roles_to_remove)
+            logger.info(
+                f"Roles for {member.display_name}: +{[r.name for r in roles_to_add]} -{[r.name for r in roles_to_remove]}"
+            )
+        except Exception as e:
+            summary.failed += 1
+            logger.info(f"Role refresh failed for account {account_id} (user {user_id}): {e!r}")
+        finally:
+            summary.done += 1
+            await self._report()
+
+    async def run(self) -> RefreshSummary:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(
+            *(self._refresh_member(semaphore, user_id, account_id) for user_id, account_id in self.accounts.items())
+        )
+        return self.summary
+
+
+async def refresh_guild_roles(guild: discord.Guild, progress=None) -> RefreshSummary:
+    csv_content = await s3helper.run_async(s3helper.read_text_s3, s3helper.ACCOUNTS_KEY) or ""
+    accounts = read_registered_accounts(csv_content)
+    return await RoleRefresh(guild, accounts, progress=progress).run()
+
+
+async def reconcile_changed_accounts(guilds: List[discord.Guild], changed_accounts) -> List[RefreshSummary]:
+    """Refresh the roles of registered members whose holdings changed, in
+    every guild they are in. Costs nothing when nothing was traded."""
+    if not changed_accounts:
+        return []
+    csv_content = await s3helper.run_async(s3helper.read_text_s3, s3helper.ACCOUNTS_KEY) or ""
+    accounts = {
+        user_id: account_id
+        for user_id, account_id in read_registered_accounts(csv_content).items()
+        if account_id in changed_accounts
+    }
+    summaries = []
+    for guild in guilds:
+        members = {user_id: account_id for user_id, account_id in accounts.items() if guild.get_member(user_id) is not None}
+        if members:
+            summaries.append(await RoleRefresh(guild, members).run())
+    return summaries
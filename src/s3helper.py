@@ -1,16 +1,171 @@
+import asyncio
+import functools
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import io
 import json
 import pandas as pd
 import base64
+from typing import Optional, Tuple
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 
 # Bucket used for processing data
 bucket = 'lost-ones-upload32737-staging'
+
+ACCOUNTS_KEY = 'public/discordAccounts/accounts.csv'
+ROLE_HELPER_KEY = 'public/discordAccounts/discordRoleHelper.json'
+MORTAL_CHALLENGE_KEY = 'public/discordAccounts/mortalChallenge.csv'
+HOLDINGS_INDEX_KEY = 'public/discordAccounts/holdingsIndex.json'
+
+# Optional endpoint for a local S3 stand-in (minio, moto server)
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '20'))
+S3_MAX_WORKERS = int(os.environ.get('S3_MAX_WORKERS', '8'))
+# Local copies of downloaded objects, revalidated with their ETag
+S3_CACHE_DIR = os.environ.get('S3_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'barbarian-bot-s3')
+# Parsed DataFrames kept in memory, keyed by object and ETag
+S3_DF_CACHE_SIZE = int(os.environ.get('S3_DF_CACHE_SIZE', '16'))
+# Rows parsed at a time by read_df_s3_filtered
+S3_CSV_CHUNK_ROWS = int(os.environ.get('S3_CSV_CHUNK_ROWS', '100000'))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=S3_MAX_WORKERS, thread_name_prefix='s3')
+_df_cache = OrderedDict()  # key -> (etag, DataFrame)
+_df_cache_lock = threading.Lock()
+
+
+def data_key(token_id, filename):
+    return f'public/data-analytics/{token_id}/{filename}'
+
+
+def get_client():
+    """Shared S3 client. boto3 clients are thread safe and keep a pool of open
+    connections, so one client per process is reused for every request."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = boto3.client(
+                    's3',
+                    endpoint_url=S3_ENDPOINT_URL,
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={'max_attempts': 3, 'mode': 'standard'},
+                    ),
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+async def run_async(fn, *args, **kwargs):
+    """Run a blocking storage call (or anything that reads from S3) on the
+    storage thread pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+def read_text_s3(key) -> Optional[str]:
+    """Read an object as text, None when it does not exist."""
+    try:
+        obj = get_client().get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == "NoSuchKey":
+            return None
+        raise
+    return obj['Body'].read().decode('utf-8')
+
+
+def write_text_s3(key, body):
+    get_client().put_object(Bucket=bucket, Key=key, Body=body)
+
+
+def _hash(value):
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def _cached_etag(key) -> Optional[str]:
+    try:
+        with open(os.path.join(S3_CACHE_DIR, _hash(key) + '.etag')) as f:
+            return f.read() or None
+    except FileNotFoundError:
+        return None
+
+
+def _cached_body_path(key, etag):
+    return os.path.join(S3_CACHE_DIR, f'{_hash(key)}-{_hash(etag)}.body')
+
+
+def _filtered_path(key, etag, cache_key):
+    # next to the body it was read from, so it goes away with that body
+    return _cached_body_path(key, etag) + f'.{_hash(repr(cache_key))}.filtered.csv'
+
+
+def _replace_file(path, write):
+    # write to a temp file and rename, so readers in other threads or processes
+    # never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=S3_CACHE_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_object_cached(key) -> Tuple[Optional[str], Optional[str]]:
+    """Local copy of an object as (path, etag), or (None, None) if the object
+    does not exist. A cached copy is revalidated with If-None-Match, so an
+    unchanged object costs one 304 response and no download."""
+    os.makedirs(S3_CACHE_DIR, exist_ok=True)
+    etag = _cached_etag(key)
+    path = _cached_body_path(key, etag) if etag else None
+    if path and not os.path.exists(path):
+        etag = path = None
+
+    try:
+        if etag:
+            obj = get_client().get_object(Bucket=bucket, Key=key, IfNoneMatch=etag)
+        else:
+            obj = get_client().get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return path, etag
+        if code == 'NoSuchKey':
+            return None, None
+        raise
+
+    new_etag = obj['ETag']
+    new_path = _cached_body_path(key, new_etag)
+    _replace_file(new_path, lambda f: shutil.copyfileobj(obj['Body'], f))
+    _replace_file(
+        os.path.join(S3_CACHE_DIR, _hash(key) + '.etag'),
+        lambda f: f.write(new_etag.encode('utf-8')),
+    )
+    if path and path != new_path:
+        # the old body and the filtered reads made from it
+        for old_path in glob.glob(glob.escape(path) + '*'):
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return new_path, new_etag
+
+
 def read_json_s3(token_id, filename):
     """Read the config JSON from an S3 bucket."""
-    s3 = boto3.client('s3')
-    key = f'public/data-analytics/{token_id}/{filename}'
+    key = data_key(token_id, filename)
     default_config = {
         "last_nft_listing_ts": 0,
         "last_nft_transaction_ts":  0,
@@ -18,7 +173,7 @@ def read_json_s3(token_id, filename):
         "last_discord_sales_ts": ""
     }
     try:
-        obj = s3.get_object(Bucket=bucket, Key=key)
+        obj = get_client().get_object(Bucket=bucket, Key=key)
         data = obj['Body'].read().decode('utf-8')
         return json.loads(data)
     except ClientError as e:
@@ -34,34 +189,130 @@ def read_json_s3(token_id, filename):
 
 
 def read_df_s3(token_id, filename):
-    """Read a DataFrame from an S3 bucket."""
-    s3 = boto3.client('s3')
-    key = f'public/data-analytics/{token_id}/{filename}'
+    """Read a DataFrame from an S3 bucket. The parsed DataFrame is kept in memory
+    by ETag, so an unchanged object is not downloaded or parsed again."""
+    key = data_key(token_id, filename)
     try:
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        data = obj['Body'].read().decode('utf-8')
-        return pd.read_csv(io.StringIO(data), delimiter='|')  # Specify delimiter here
+        path, etag = read_object_cached(key)
     except ClientError as e:
-        if e.response['Error']['Code'] == "NoSuchKey":
-            print(f"No data found for token_id {token_id} & {filename}.")
-            return pd.DataFrame()
-        else:
-            print(f"Unexpected error: {e}")
-            return pd.DataFrame()
+        print(f"Unexpected error: {e}")
+        return pd.DataFrame()
     except (NoCredentialsError, PartialCredentialsError):
         print("Credentials not available")
         return pd.DataFrame()
+    if path is None:
+        print(f"No data found for token_id {token_id} & {filename}.")
+        return pd.DataFrame()
+
+    with _df_cache_lock:
+        cached = _df_cache.get(key)
+        if cached is not None and cached[0] == etag:
+            _df_cache.move_to_end(key)
+            # callers add and convert columns, hand out a copy
+            return cached[1].copy()
+
+    df = pd.read_csv(path, delimiter='|')  # Specify delimiter here
+    with _df_cache_lock:
+        _df_cache[key] = (etag, df)
+        _df_cache.move_to_end(key)
+        while len(_df_cache) > S3_DF_CACHE_SIZE:
+            _df_cache.popitem(last=False)
+    return df.copy()
+
+def _apply_schema(df, schema):
+    for column, kind in schema.items():
+        if column not in df:
+            continue
+        if kind == 'datetime':
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+        elif kind == 'numeric':
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+def read_df_s3_filtered(token_id, filename, schema, row_filter=None, chunksize=None, cache_key=None):
+    """Read a CSV in chunks keeping only the schema columns and the rows where
+    row_filter(chunk) is True, so memory grows with the kept rows and not with
+    the whole file.
+
+    schema maps column name to 'datetime', 'numeric', 'category' or 'str'
+    (kept as the text in the file).
+
+    cache_key names the row_filter (e.g. the watermark it compares against).
+    When given, the kept rows are stored next to the cached object, and a
+    later read with the same cache_key and an unchanged ETag parses only
+    those instead of the whole CSV."""
+    key = data_key(token_id, filename)
+    try:
+        # the body is streamed to the local cache file, then parsed from disk
+        path, etag = read_object_cached(key)
+    except ClientError as e:
+        print(f"Unexpected error: {e}")
+        return pd.DataFrame()
+    except (NoCredentialsError, PartialCredentialsError):
+        print("Credentials not available")
+        return pd.DataFrame()
+    if path is None:
+        print(f"No data found for token_id {token_id} & {filename}.")
+        return pd.DataFrame()
+
+    filtered_path = None
+    if cache_key is not None:
+        filtered_path = _filtered_path(key, etag, (sorted(schema.items()), cache_key))
+        # plain CSV parsed with the schema again, S3_CACHE_DIR may be a
+        # directory other local users can write to
+        try:
+            if os.path.getsize(filtered_path) == 0:
+                return pd.DataFrame()
+            return _read_csv_filtered(filtered_path, schema, None, chunksize)
+        except FileNotFoundError:
+            pass
+
+    df = _read_csv_filtered(path, schema, row_filter, chunksize)
+    if filtered_path is not None:
+        body = df.to_csv(sep='|', index=False).encode('utf-8') if not df.empty else b''
+        _replace_file(filtered_path, lambda f: f.write(body))
+    return df
+
+
+def _read_csv_filtered(path, schema, row_filter, chunksize):
+    text_columns = {
+        c: str for c, kind in schema.items() if kind in ('str', 'category')
+    }
+    kept = []
+    with pd.read_csv(
+        path,
+        delimiter='|',
+        usecols=lambda c: c in schema,
+        dtype=text_columns,
+        chunksize=chunksize or S3_CSV_CHUNK_ROWS,
+    ) as reader:
+        for chunk in reader:
+            chunk = _apply_schema(chunk, schema)
+            if row_filter is not None:
+                chunk = chunk[row_filter(chunk)]
+            if not chunk.empty:
+                kept.append(chunk)
+
+    if not kept:
+        return pd.DataFrame()
+    df = pd.concat(kept, ignore_index=True)
+    # categories are set after concat so all chunks share them
+    for column, kind in schema.items():
+        if kind == 'category' and column in df:
+            df[column] = df[column].astype('category')
+    return df
+
 
 def upload_json_s3(token_id, filename, json_data):
     """Update and save the config JSON to S3."""
-    s3 = boto3.client('s3')
-    key = f'public/data-analytics/{token_id}/{filename}'
+    key = data_key(token_id, filename)
 
     # Convert config to JSON format
     str_data = json.dumps(json_data)
 
     try:
-        s3.put_object(Bucket=bucket, Key=key, Body=str_data)
+        get_client().put_object(Bucket=bucket, Key=key, Body=str_data)
         print(f"Updated json for token_id {token_id} {filename} saved to S3.")
     except ClientError as e:
         print(f"Error saving updated config to S3: {e}")
@@ -71,8 +322,7 @@ def upload_json_s3(token_id, filename, json_data):
 
 def upload_df_s3(token_id, filename, df):
     """Save the updated NFT data back to S3, overwriting the original file."""
-    s3 = boto3.client('s3')
-    key = f'public/data-analytics/{token_id}/{filename}'
+    key = data_key(token_id, filename)
 
     # Convert list of dictionaries to DataFrame
     df = pd.DataFrame(df)
@@ -82,9 +332,9 @@ def upload_df_s3(token_id, filename, df):
     df.to_csv(csv_buffer, sep='|', index=False)
 
     try:
-        s3.put_object(Bucket=bucket, Key=key, Body=csv_buffer.getvalue())
+        get_client().put_object(Bucket=bucket, Key=key, Body=csv_buffer.getvalue())
         print(f"Updated data token_id {token_id} {filename} saved to S3.")
     except ClientError as e:
         print(f"Error saving updated NFT data to S3: {e}")
     except (NoCredentialsError, PartialCredentialsError):
-        print("Credentials not available")
\ No newline at end of file
+        print("Credentials not available")
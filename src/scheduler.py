@@ -0,0 +1,52 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+from src.utils import logger
+
+
+class DebounceScheduler:
+    """Keeps one pending reply job per key (thread). Scheduling again restarts
+    the delay and cancels the previous job, including its in-flight
+    completion, unless that job already started posting (see detach)."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        # detached jobs that are still posting, later jobs wait for them
+        self._posting: Dict[Hashable, asyncio.Task] = {}
+
+    def schedule(self, key: Hashable, job: Callable[[], Awaitable[None]]) -> asyncio.Task:
+        previous = self._pending.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+        task = asyncio.create_task(self._run(key, job))
+        self._pending[key] = task
+        return task
+
+    def detach(self, key: Hashable, task: asyncio.Task):
+        """Called from a job once it starts posting, so that newer messages no
+        longer cancel it halfway through a reply. task is the job's own task,
+        taken with asyncio.current_task() at the top of the job: the callback
+        may run inside other tasks (wait_for, admission workers)."""
+        if self._pending.get(key) is task:
+            del self._pending[key]
+            self._posting[key] = task
+
+    async def _run(self, key: Hashable, job: Callable[[], Awaitable[None]]):
+        task = asyncio.current_task()
+        try:
+            if self.delay > 0:
+                await asyncio.sleep(self.delay)
+            posting = self._posting.get(key)
+            if posting is not None and not posting.done():
+                await asyncio.wait({posting})
+            await job()
+        except asyncio.CancelledError:
+            logger.info(f"Reply for {key} superseded by a newer message")
+            raise
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            if self._pending.get(key) is task:
+                del self._pending[key]
+            if self._posting.get(key) is task:
+                del self._posting[key]
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# src.constants reads these at import time, the values are never used in tests
+for name in ("DISCORD_BOT_TOKEN", "DISCORD_CLIENT_ID", "OPENAI_API_KEY", "TENOR_KEY"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("ALLOWED_SERVER_IDS", "1")
+os.environ.setdefault("SERVER_TO_MODERATION_CHANNEL", "1:1")
+os.environ.setdefault("S3_CACHE_DIR", tempfile.mkdtemp(prefix="barbarian-bot-test-s3-"))
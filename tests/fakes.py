@@ -0,0 +1,38 @@
+import io
+from contextlib import contextmanager
+from typing import Dict
+
+from botocore.exceptions import ClientError
+
+import src.s3helper as s3helper
+
+
+class FakeS3:
+    """Just enough of the boto3 s3 client for the code under test and benchmark."""
+
+    def __init__(self, objects: Dict[str, bytes]):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        data = self.objects[Key]
+        etag = f'"{hash(data)}"'
+        if IfNoneMatch == etag:
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        return {"Body": io.BytesIO(data), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body.encode("utf-8") if isinstance(Body, str) else Body
+        return {"ETag": f'"{hash(self.objects[Key])}"'}
+
+
+@contextmanager
+def fake_s3(objects: Dict[str, bytes]):
+    client = FakeS3(objects)
+    original = s3helper.get_client
+    s3helper.get_client = lambda: client
+    try:
+        yield client
+    finally:
+        s3helper.get_client = original
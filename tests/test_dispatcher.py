@@ -0,0 +1,71 @@
+import asyncio
+
+import discord
+
+from src.dispatcher import EmbedDispatcher
+
+
+class FakeChannel:
+    def __init__(self, channel_id, failures=0):
+        self.id = channel_id
+        self.failures = failures
+        self.sent = []
+
+    async def send(self, embeds):
+        await asyncio.sleep(0)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("503 Service Unavailable")
+        self.sent.append([embed.title for embed in embeds])
+
+
+def test_failed_post_cancels_the_rest_of_its_group():
+    listings = FakeChannel(1, failures=1)
+    sales = FakeChannel(2)
+
+    async def main():
+        dispatcher = EmbedDispatcher(batch_size=1, batch_max_chars=6000, max_retries=1, backoff_seconds=0)
+        first, second = asyncio.Event(), asyncio.Event()
+        futures = [
+            dispatcher.submit(listings, discord.Embed(title="first listing"), first),
+            dispatcher.submit(sales, discord.Embed(title="second sale"), second),
+            dispatcher.submit(listings, discord.Embed(title="first listing 2"), first),
+            dispatcher.submit(sales, discord.Embed(title="first sale"), first),
+            dispatcher.submit(listings, discord.Embed(title="second listing"), second),
+        ]
+        results = await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+        assert first.is_set() and not second.is_set()
+        assert dispatcher.queue_depth() == 0
+        return results
+
+    results = asyncio.run(main())
+    assert results == [False, True, False, False, True]
+    assert listings.sent == [["second listing"]]
+    assert sales.sent == [["second sale"]]
+
+
+def test_failure_on_one_channel_leaves_the_other_channels_group_alone():
+    # one collection: its listings fail after its sales were already posted
+    listings = FakeChannel(1)
+    sales = FakeChannel(2)
+
+    async def main():
+        dispatcher = EmbedDispatcher(batch_size=1, batch_max_chars=6000, max_retries=1, backoff_seconds=0)
+        listing_group, sale_group = asyncio.Event(), asyncio.Event()
+        sale = dispatcher.submit(sales, discord.Embed(title="sale"), sale_group)
+        assert await asyncio.wait_for(sale, timeout=5)
+
+        listings.failures = 1
+        futures = [
+            dispatcher.submit(listings, discord.Embed(title="listing"), listing_group),
+            dispatcher.submit(listings, discord.Embed(title="listing 2"), listing_group),
+            dispatcher.submit(sales, discord.Embed(title="sale 2"), sale_group),
+        ]
+        results = await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+        assert listing_group.is_set() and not sale_group.is_set()
+        return results
+
+    results = asyncio.run(main())
+    assert results == [False, False, True]
+    assert listings.sent == []
+    assert sales.sent == [["sale"], ["sale 2"]]
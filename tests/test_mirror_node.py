@@ -0,0 +1,86 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.mirrorNode import MirrorNodeClient
+
+PAGE_SIZE = 10
+SERIALS = 25
+
+
+def stand_in():
+    """Account NFT listings of a mirror node: SERIALS serials per token,
+    newest first, PAGE_SIZE per page. The first request answers 503 and
+    account 0.0.404 does not exist."""
+    requests = []
+    failures = {"left": 1}
+
+    async def account_nfts(request):
+        requests.append(str(request.rel_url))
+        account_id = request.match_info["account_id"]
+        if account_id == "0.0.404":
+            return web.json_response({"_status": {"messages": [{"message": "Not found"}]}}, status=404)
+        if failures["left"]:
+            failures["left"] -= 1
+            return web.Response(status=503)
+
+        token_id = request.query["token.id"]
+        limit = int(request.query["limit"])
+        below = int(request.query.get("serialnumber", f"lt:{SERIALS + 1}").split(":")[1])
+        serials = list(range(below - 1, max(0, below - 1 - limit), -1))
+        next_path = None
+        if serials and serials[-1] > 1:
+            next_path = (
+                f"/api/v1/accounts/{account_id}/nfts?limit={limit}"
+                f"&token.id={token_id}&serialnumber=lt:{serials[-1]}"
+            )
+        return web.json_response({
+            "nfts": [{"token_id": token_id, "serial_number": s} for s in serials],
+            "links": {"next": next_path},
+        })
+
+    app = web.Application()
+    app.router.add_get("/api/v1/accounts/{account_id}/nfts", account_nfts)
+    return app, requests
+
+
+async def _with_client(test):
+    app, requests = stand_in()
+    server = TestServer(app)
+    await server.start_server()
+    client = MirrorNodeClient(
+        base_url=str(server.make_url("")),
+        timeout_seconds=5,
+        retries=2,
+        backoff_seconds=0.01,
+        concurrency=4,
+        page_size=PAGE_SIZE,
+    )
+    try:
+        return await asyncio.wait_for(test(client), timeout=10), requests
+    finally:
+        await client.close()
+        await server.close()
+
+
+def test_account_nfts_follows_pages_and_retries_a_503():
+    nfts, requests = asyncio.run(
+        _with_client(lambda client: client.account_nfts("0.0.1", ["0.0.100", "0.0.200"]))
+    )
+
+    for token_id in ("0.0.100", "0.0.200"):
+        serials = [nft["serial_number"] for nft in nfts if nft["token_id"] == token_id]
+        assert serials == list(range(SERIALS, 0, -1))
+    # 3 pages per token and the retried 503
+    assert len(requests) == 2 * 3 + 1
+    assert all("token.id=" in r for r in requests)
+
+
+def test_unknown_account_has_no_nfts():
+    nfts, requests = asyncio.run(
+        _with_client(lambda client: client.account_nfts("0.0.404", ["0.0.100"]))
+    )
+
+    assert nfts == []
+    assert len(requests) == 1
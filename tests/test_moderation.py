@@ -0,0 +1,30 @@
+import asyncio
+from types import SimpleNamespace
+
+import src.moderation as moderation
+from src.moderation import ModerationService
+
+
+def test_inputs_without_a_result_fail_instead_of_hanging(monkeypatch):
+    async def acreate(input, model):
+        # one result short
+        return SimpleNamespace(
+            results=[{"category_scores": {"hate": 0.1 * i}} for i in range(len(input) - 1)]
+        )
+
+    monkeypatch.setattr(moderation.openai.Moderation, "acreate", acreate)
+
+    async def main():
+        service = ModerationService(batch_window=0.01, max_batch_size=10, cache_size=10)
+        return await asyncio.wait_for(
+            asyncio.gather(
+                service.category_scores("first"),
+                service.category_scores("second"),
+                return_exceptions=True,
+            ),
+            timeout=5,
+        )
+
+    first, second = asyncio.run(main())
+    assert first == {"hate": 0.0}
+    assert isinstance(second, RuntimeError)
@@ -0,0 +1,58 @@
+import json
+from datetime import datetime
+
+import src.s3helper as s3helper
+from src.nftEvents import CollectionBatch, NftEvent
+
+TOKEN_ID = "0.0.2235264"
+
+
+def event(event_type, serial_number, txn_time):
+    return NftEvent(
+        event_type=event_type,
+        token_id=TOKEN_ID,
+        name="Barbarian",
+        serial_number=serial_number,
+        txn_time=txn_time,
+        market_name="SentX",
+        market_link="https://sentx.io",
+        image_url="https://example.com/1.png",
+        amount="100",
+        account_id_seller="0.0.1",
+    )
+
+
+def commit(monkeypatch, events, delivered):
+    stored = {"last_nft_listing_ts": 7, "last_discord_listings_ts": "", "last_discord_sales_ts": ""}
+    monkeypatch.setattr(s3helper, "read_text_s3", lambda key: json.dumps(stored))
+    monkeypatch.setattr(s3helper, "upload_json_s3", lambda token_id, filename, config: stored.update(config))
+    batch = CollectionBatch(token_id=TOKEN_ID, config={}, events=events)
+    return batch.commit(delivered), stored
+
+
+def test_watermark_stops_before_an_undelivered_event_in_the_same_second(monkeypatch):
+    events = [
+        event("Sale", 1, datetime(2024, 1, 1, 0, 0, 1)),
+        event("Sale", 2, datetime(2024, 1, 1, 0, 0, 2, 100000)),
+        event("Sale", 3, datetime(2024, 1, 1, 0, 0, 2, 600000)),
+        event("Listing", 4, datetime(2024, 1, 1, 0, 0, 2, 700000)),
+    ]
+
+    moved, stored = commit(monkeypatch, events, [events[0], events[1], events[3]])
+
+    assert moved
+    assert stored["last_discord_sales_ts"] == "2024-01-01 00:00:01"
+    assert stored["last_discord_listings_ts"] == "2024-01-01 00:00:02"
+    assert stored["last_nft_listing_ts"] == 7
+
+
+def test_watermark_stays_when_the_oldest_event_is_undelivered(monkeypatch):
+    events = [
+        event("Sale", 1, datetime(2024, 1, 1, 0, 0, 1, 200000)),
+        event("Sale", 2, datetime(2024, 1, 1, 0, 0, 1, 500000)),
+    ]
+
+    moved, stored = commit(monkeypatch, events, [events[1]])
+
+    assert not moved
+    assert stored["last_discord_sales_ts"] == ""
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+
+import src.main as main
+from src.nftEvents import CollectionBatch, NftEvent
+from tests.test_dispatcher import FakeChannel
+
+TOKEN_ID = "0.0.2235264"
+
+
+def event(event_type, serial_number, second):
+    return NftEvent(
+        event_type=event_type,
+        token_id=TOKEN_ID,
+        name="Barbarian",
+        serial_number=serial_number,
+        txn_time=datetime(2024, 1, 1, 0, 0, second),
+        market_name="SentX",
+        market_link="https://sentx.io",
+        image_url="https://example.com/1.png",
+        amount="100",
+        account_id_seller="0.0.1",
+        account_id_buyer="0.0.2" if event_type == "Sale" else None,
+    )
+
+
+def test_failed_listing_does_not_hold_back_posted_sales(monkeypatch):
+    batch = CollectionBatch(token_id=TOKEN_ID, config={})
+    batch.events = [
+        event("Sale", 1, 0),
+        event("Listing", 2, 1),
+        event("Sale", 3, 2),
+        event("Listing", 4, 3),
+    ]
+    channels = {"Listing": FakeChannel(1, failures=1), "Sale": FakeChannel(2)}
+    committed = []
+
+    async def collect_all(token_ids):
+        return [batch]
+
+    async def reconcile_roles():
+        pass
+
+    monkeypatch.setattr(main.nftEvents, "collect_all", collect_all)
+    monkeypatch.setattr(main, "get_event_channel", channels.get)
+    monkeypatch.setattr(main, "reconcile_roles", reconcile_roles)
+    monkeypatch.setattr(batch, "commit", committed.extend)
+    monkeypatch.setattr(main.embed_dispatcher, "max_retries", 1)
+
+    asyncio.run(asyncio.wait_for(main.process_events([TOKEN_ID]), timeout=5))
+
+    assert [(e.event_type, e.serial_number) for e in committed] == [("Sale", 1), ("Sale", 3)]
+    assert sum(len(message) for message in channels["Sale"].sent) == 2
+    assert channels["Listing"].sent == []
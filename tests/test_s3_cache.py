@@ -0,0 +1,103 @@
+import os
+
+import pandas as pd
+
+import src.s3helper as s3helper
+from tests.fakes import FakeS3
+
+TOKEN_ID = "0.0.2235264"
+FILENAME = "nft_transactions.csv"
+KEY = s3helper.data_key(TOKEN_ID, FILENAME)
+
+
+class CountingS3(FakeS3):
+    """FakeS3 recording what every get_object call answered."""
+
+    def __init__(self, objects):
+        super().__init__(objects)
+        self.responses = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        try:
+            response = super().get_object(Bucket, Key, IfNoneMatch=IfNoneMatch, **kwargs)
+        except Exception as e:
+            self.responses.append(e.response["Error"]["Code"])
+            raise
+        self.responses.append("200")
+        return response
+
+
+def test_object_is_downloaded_once_and_parsed_once_per_etag(monkeypatch):
+    parses = []
+    read_csv = pd.read_csv
+
+    def counting_read_csv(*args, **kwargs):
+        parses.append(args[0])
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(s3helper.pd, "read_csv", counting_read_csv)
+    s3helper._df_cache.clear()
+
+    first = b"serial_number|amount\n1|100\n2|200\n"
+    second = b"serial_number|amount\n1|100\n2|200\n3|300\n"
+    client = CountingS3({KEY: first})
+    monkeypatch.setattr(s3helper, "get_client", lambda: client)
+
+    df = s3helper.read_df_s3(TOKEN_ID, FILENAME)
+    assert client.responses == ["200"]
+    assert len(parses) == 1
+    assert df["amount"].tolist() == [100, 200]
+    old_path, old_etag = s3helper.read_object_cached(KEY)
+    client.responses.clear()
+
+    # unchanged object: a 304 and the parsed frame from memory
+    df = s3helper.read_df_s3(TOKEN_ID, FILENAME)
+    assert client.responses == ["304"]
+    assert len(parses) == 1
+    assert df["amount"].tolist() == [100, 200]
+
+    # new ETag: downloaded again and the old body is removed
+    client.objects[KEY] = second
+    df = s3helper.read_df_s3(TOKEN_ID, FILENAME)
+    assert client.responses == ["304", "200"]
+    assert len(parses) == 2
+    assert df["amount"].tolist() == [100, 200, 300]
+    new_path, new_etag = s3helper.read_object_cached(KEY)
+    assert new_etag != old_etag
+    assert not os.path.exists(old_path)
+    with open(new_path, "rb") as f:
+        assert f.read() == second
+
+
+def test_filtered_read_is_reused_while_object_and_key_are_unchanged(monkeypatch):
+    schema = {"txn_time": "datetime", "serial_number": "numeric", "market_name": "category", "amount": "str"}
+    body = (
+        b"txn_time|serial_number|market_name|amount|extra\n"
+        b"2024-01-01 00:00:00|1|SentX|100|x\n"
+        b"2024-01-02 00:00:00|2|Zuse|Bulk Listing|x\n"
+        b"2024-01-03 00:00:00|3|SentX|4393|x\n"
+    )
+    client = CountingS3({KEY: body})
+    monkeypatch.setattr(s3helper, "get_client", lambda: client)
+    filters = []
+
+    def newer_than(watermark):
+        def row_filter(chunk):
+            filters.append(watermark)
+            return chunk["txn_time"] > watermark
+        return row_filter
+
+    watermark = "2024-01-01 00:00:00"
+    first = s3helper.read_df_s3_filtered(TOKEN_ID, FILENAME, schema, newer_than(watermark), cache_key=watermark)
+    again = s3helper.read_df_s3_filtered(TOKEN_ID, FILENAME, schema, newer_than(watermark), cache_key=watermark)
+    assert filters == [watermark]
+    pd.testing.assert_frame_equal(first, again)
+    assert again["amount"].tolist() == ["Bulk Listing", "4393"]
+    assert str(again["txn_time"].dtype) == "datetime64[ns]"
+    assert str(again["market_name"].dtype) == "category"
+
+    later = "2024-01-03 00:00:00"
+    empty = s3helper.read_df_s3_filtered(TOKEN_ID, FILENAME, schema, newer_than(later), cache_key=later)
+    assert empty.empty
+    assert s3helper.read_df_s3_filtered(TOKEN_ID, FILENAME, schema, newer_than(later), cache_key=later).empty
+    assert filters == [watermark, later]
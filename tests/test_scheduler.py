@@ -0,0 +1,69 @@
+import asyncio
+
+from src.scheduler import DebounceScheduler
+
+
+async def _in_other_tasks(coro):
+    # what a streamed reply goes through: admission worker task + wait_for
+    return await asyncio.create_task(asyncio.wait_for(coro, timeout=5))
+
+
+def test_detached_stream_is_not_cancelled_by_a_new_message():
+    events = []
+
+    async def main():
+        scheduler = DebounceScheduler(delay=0)
+        first_posted = asyncio.Event()
+
+        async def stream_reply():
+            task = asyncio.current_task()
+
+            async def stream():
+                events.append("first post")
+                scheduler.detach("thread", task)
+                first_posted.set()
+                await asyncio.sleep(0.05)
+                events.append("stream done")
+
+            await _in_other_tasks(stream())
+
+        async def second_reply():
+            events.append("second reply")
+
+        first = scheduler.schedule("thread", stream_reply)
+        await asyncio.wait_for(first_posted.wait(), timeout=5)
+        second = scheduler.schedule("thread", second_reply)
+        await asyncio.gather(first, second)
+        assert not first.cancelled()
+
+    asyncio.run(main())
+    assert events == ["first post", "stream done", "second reply"]
+
+
+def test_pending_job_is_cancelled_by_a_new_message():
+    events = []
+
+    async def main():
+        scheduler = DebounceScheduler(delay=0)
+        started = asyncio.Event()
+
+        async def generate():
+            started.set()
+            await asyncio.sleep(1)
+
+        async def slow_reply():
+            await _in_other_tasks(generate())
+            events.append("slow reply")
+
+        async def new_reply():
+            events.append("new reply")
+
+        first = scheduler.schedule("thread", slow_reply)
+        await asyncio.wait_for(started.wait(), timeout=5)
+        second = scheduler.schedule("thread", new_reply)
+        await second
+        await asyncio.gather(first, return_exceptions=True)
+        assert first.cancelled()
+
+    asyncio.run(main())
+    assert events == ["new reply"]